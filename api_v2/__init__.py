@@ -2,18 +2,38 @@ from fastapi import FastAPI
 from tortoise import Tortoise
 from fastapi.middleware.cors import CORSMiddleware
 from . import settings
-from .cache import RedisCache
+from .cache import RedisCache, weather_service
 from .cache.cache import init_cache
+from .heating.broadcaster import state_broadcaster
+from .heating.control_scheduler import control_scheduler
+from .heating.gpio_state import gpio_hosts
 from .heating.heating_system import HeatingSystem
+from .heating.program_state import program_state
+from .heating.telemetry_store import telemetry_store
 from .heating.systems_in_memory import systems_in_memory
-from .models import HeatingSystemModel
+from .metrics import (
+    MetricsMiddleware,
+    ServerTimingMiddleware,
+    instrument_tortoise,
+    memory_tracker,
+)
+from .models import HeatingSystemModel, tune_database
+
+from .utils import init_http_session, close_http_session
 
-from .routes import auth_router, heating_v2_router, secrets_router, weather_router
+from .routes import (
+    auth_router,
+    heating_v2_router,
+    metrics_router,
+    secrets_router,
+    weather_router,
+)
 
 
 app = FastAPI()
 app.include_router(auth_router)
 app.include_router(heating_v2_router)
+app.include_router(metrics_router)
 app.include_router(secrets_router)
 app.include_router(weather_router)
 app.add_middleware(
@@ -23,11 +43,16 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
+app.add_middleware(MetricsMiddleware)
+if settings.SERVER_TIMING:
+    app.add_middleware(ServerTimingMiddleware)
 
 
 async def init_db():
     await Tortoise.init(config=settings.TORTOISE_ORM)
     await Tortoise.generate_schemas()
+    await tune_database()
+    instrument_tortoise()
 
 
 async def init_heating_systems():
@@ -46,10 +71,24 @@ async def init_heating_systems():
 @app.on_event("startup")
 async def run_init():
     await init_db()
+    await init_http_session()
     await init_cache()
+    weather_service.start()
+    control_scheduler.start()
+    gpio_hosts.start()
+    telemetry_store.start()
+    memory_tracker.start()
     await init_heating_systems()
 
 
 @app.on_event("shutdown")
 async def close_down():
+    weather_service.stop()
+    state_broadcaster.close()
+    await control_scheduler.stop()
+    await gpio_hosts.close_all()
+    await program_state.close()
+    await telemetry_store.close()
+    memory_tracker.stop()
+    await close_http_session()
     await Tortoise.close_connections()
@@ -1,2 +1,4 @@
 from .cache import RedisCache
 from .redis_funcs import get_weather, set_weather
+from .auth_cache import MISSING, token_cache, user_cache
+from .weather import weather_service
@@ -0,0 +1,86 @@
+import time
+from collections import OrderedDict
+from typing import Hashable, Optional
+
+from api_v2.metrics import Counter
+from api_v2.settings import (
+    AUTH_TOKEN_CACHE_SIZE,
+    AUTH_USER_CACHE_SIZE,
+    AUTH_USER_CACHE_TTL,
+)
+
+MISSING = object()
+
+AUTH_CACHE_LOOKUPS = Counter(
+    "auth_cache_lookups", "Auth cache lookups by cache and outcome", ("cache", "result")
+)
+
+
+class TokenCache:
+    """LRU of already verified JWTs to their claims. Entries are only served
+    until the token's own `exp`, after which the caller decodes it again
+    (and gets the expiry error)."""
+
+    def __init__(self, maxsize: int = AUTH_TOKEN_CACHE_SIZE):
+        self.maxsize = maxsize
+        self._claims: "OrderedDict[str, dict]" = OrderedDict()
+
+    def get(self, token: str) -> Optional[dict]:
+        claims = self._claims.get(token)
+        if claims is not None and claims.get("exp", float("inf")) <= time.time():
+            del self._claims[token]
+            claims = None
+        AUTH_CACHE_LOOKUPS.labels("token", "miss" if claims is None else "hit").inc()
+        if claims is not None:
+            self._claims.move_to_end(token)
+        return claims
+
+    def set(self, token: str, claims: dict):
+        self._claims[token] = claims
+        self._claims.move_to_end(token)
+        while len(self._claims) > self.maxsize:
+            self._claims.popitem(last=False)
+
+    def invalidate_subject(self, subject: str):
+        for token, claims in list(self._claims.items()):
+            if claims.get("sub") == subject:
+                del self._claims[token]
+
+    def clear(self):
+        self._claims.clear()
+
+
+class TTLCache:
+    """Bounded mapping whose entries expire `ttl` seconds after being set.
+    None is a valid value, so misses are reported as MISSING."""
+
+    def __init__(self, name: str, ttl: float, maxsize: int):
+        self.name = name
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._items: "OrderedDict[Hashable, tuple]" = OrderedDict()
+
+    def get(self, key: Hashable):
+        item = self._items.get(key)
+        if item is not None and item[0] <= time.monotonic():
+            del self._items[key]
+            item = None
+        AUTH_CACHE_LOOKUPS.labels(self.name, "miss" if item is None else "hit").inc()
+        return MISSING if item is None else item[1]
+
+    def set(self, key: Hashable, value):
+        self._items[key] = (time.monotonic() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._items.pop(key, None)
+
+    def clear(self):
+        self._items.clear()
+
+
+token_cache = TokenCache()
+# HouseholdMember (or None for unknown names) by name
+user_cache = TTLCache("user", AUTH_USER_CACHE_TTL, AUTH_USER_CACHE_SIZE)
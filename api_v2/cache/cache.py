@@ -3,12 +3,17 @@ import asyncio
 import aioredis
 
 from api_v2.logger import get_logger
+from api_v2.metrics import Counter
 from api_v2.settings import GLOBAL_LOG_LEVEL
 
 cache_singleton = None
 
 logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
 
+CACHE_LOOKUPS = Counter(
+    "redis_cache_lookups", "Redis cache lookups by key and outcome", ("key", "result")
+)
+
 
 class RedisCache:
 
@@ -37,7 +42,9 @@ class RedisCache:
         await self.cache.set(key, value)
 
     async def get_item(self, key):
-        return await self.cache.get(key, encoding="utf-8")
+        value = await self.cache.get(key, encoding="utf-8")
+        CACHE_LOOKUPS.labels(key, "miss" if value is None else "hit").inc()
+        return value
 
     async def get_keys(self):
         return await self.cache.keys("*", encoding="utf-8")
@@ -46,7 +53,7 @@ class RedisCache:
         await self.cache.delete(key)
 
     async def execute(self, *args, **kwargs):
-        self.cache.execute(*args, **kwargs)
+        return await self.cache.execute(*args, **kwargs)
 
 
 async def init_cache():
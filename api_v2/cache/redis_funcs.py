@@ -1,21 +1,30 @@
 import json
+from typing import Optional
 
-from .cache import RedisCache, cache_singleton
+from . import cache
+from .cache import RedisCache
+from api_v2.settings import WEATHER_CACHE_EXPIRY
 
 
-async def check_create_cache():
-    if cache_singleton is None:
-        global cache
-        cache = RedisCache()
+def get_cache() -> Optional[RedisCache]:
+    """The shared Redis cache, or None until init_cache has connected"""
+    if cache.cache_singleton is None:
+        return None
+    return RedisCache()
 
 
 async def set_weather(weather_dict: dict):
-    await check_create_cache()
-    await cache.execute("set", "weather", json.dumps(weather_dict), "ex", 900)
+    redis = get_cache()
+    if redis is not None:
+        await redis.execute(
+            "set", "weather", json.dumps(weather_dict), "ex", WEATHER_CACHE_EXPIRY
+        )
 
 
 async def get_weather():
-    await check_create_cache()
-    w = await cache.get_item("weather")
+    redis = get_cache()
+    if redis is None:
+        return None
+    w = await redis.get_item("weather")
     if w:
         return json.loads(w)
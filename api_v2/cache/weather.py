@@ -0,0 +1,105 @@
+import asyncio
+import time
+from typing import Optional, Tuple
+
+from .redis_funcs import get_cache, get_weather, set_weather
+from ..heating.constants import WEATHER_URL
+from ..heating.readings import CachedReading
+from ..logger import get_logger
+from ..utils import get_json
+from api_v2.settings import (
+    GLOBAL_LOG_LEVEL,
+    WEATHER_REFRESH_INTERVAL,
+    WEATHER_RETRY_DELAY,
+)
+
+logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
+
+
+class WeatherService:
+    """Keeps the OpenWeatherMap report in memory and refreshes it in the
+    background before it is due, so /weather/ is always a memory read.
+    If upstream fails the last report is kept and served with its age;
+    the report is also mirrored to Redis so a restart starts warm.
+    Refreshes share one in-flight request (CachedReading)."""
+
+    def __init__(self):
+        self.reading = CachedReading(self.fetch, WEATHER_REFRESH_INTERVAL)
+        self.fetched_at: Optional[float] = None
+        self.last_error: Optional[str] = None
+        self._loaded = False
+        self._task: Optional[asyncio.Task] = None
+
+    async def fetch(self) -> dict:
+        r = await get_json(WEATHER_URL)
+        weather = {"current": r["current"], "daily": r["daily"]}
+        self.fetched_at = time.time()
+        await set_weather({**weather, "fetched_at": self.fetched_at})
+        return weather
+
+    @property
+    def age(self) -> Optional[float]:
+        if self.fetched_at is None:
+            return None
+        return time.time() - self.fetched_at
+
+    async def _load(self):
+        """Seeds memory from Redis once it is connected, keeping the
+        original fetch time"""
+        if get_cache() is None:
+            return
+        self._loaded = True
+        cached = await get_weather()
+        if not cached or self.reading.value is not None:
+            return
+        self.fetched_at = cached.pop("fetched_at", None) or time.time()
+        self.reading.value = cached
+        self.reading.fetched_at = time.monotonic() - self.age
+
+    async def refresh(self):
+        try:
+            await self.reading.get(0)
+            self.last_error = None
+        except Exception as e:
+            self.last_error = f"{e.__class__.__name__}: {e}"
+            logger.error(f"Weather refresh failed ({self.last_error})")
+            raise
+
+    async def get(self) -> Tuple[Optional[dict], Optional[float]]:
+        """The latest report and its age in seconds, however old. Only
+        waits on upstream when there has never been a report."""
+        if not self._loaded:
+            await self._load()
+        if self.reading.value is None:
+            try:
+                await self.refresh()
+            except Exception:
+                return None, None
+        return self.reading.value, self.age
+
+    async def _maintain(self):
+        while True:
+            if not self._loaded:
+                await self._load()
+            age = self.age
+            if age is None or age >= WEATHER_REFRESH_INTERVAL:
+                try:
+                    await self.refresh()
+                    delay = WEATHER_REFRESH_INTERVAL
+                except Exception:
+                    delay = WEATHER_RETRY_DELAY
+            else:
+                delay = WEATHER_REFRESH_INTERVAL - age
+            await asyncio.sleep(delay)
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._maintain())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+weather_service = WeatherService()
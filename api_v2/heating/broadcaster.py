@@ -0,0 +1,101 @@
+import asyncio
+import json
+from typing import Dict, Set
+
+from ..metrics import Counter, Gauge
+from api_v2.settings import STREAM_QUEUE_SIZE
+
+STREAM_EVENTS = Counter(
+    "heating_stream_events", "State events published to stream clients", ("event",)
+)
+STREAM_DROPPED = Counter(
+    "heating_stream_dropped", "Stream clients disconnected for falling behind"
+)
+
+
+def encode_event(event: str, data) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+
+class StateBroadcaster:
+    """Fans HeatingSystem state changes out to every stream client of the
+    household. Each change is diffed against the last published state and
+    encoded once; subscribers only receive the ready-made bytes, so the
+    cost of a change doesn't depend on how many clients are listening. A
+    client whose queue fills up is disconnected and resyncs from a new
+    snapshot when it reconnects."""
+
+    def __init__(self, queue_size: int = STREAM_QUEUE_SIZE):
+        self.queue_size = queue_size
+        self._states: Dict[int, Dict[int, dict]] = {}
+        self._subscribers: Dict[int, Set[asyncio.Queue]] = {}
+
+    @property
+    def subscribers(self) -> int:
+        return sum(len(queues) for queues in self._subscribers.values())
+
+    def subscribe(self, household_id: int) -> asyncio.Queue:
+        queue = asyncio.Queue(self.queue_size)
+        self._subscribers.setdefault(household_id, set()).add(queue)
+        return queue
+
+    def unsubscribe(self, household_id: int, queue: asyncio.Queue):
+        queues = self._subscribers.get(household_id)
+        if queues is not None:
+            queues.discard(queue)
+            if not queues:
+                del self._subscribers[household_id]
+
+    def snapshot(self, household_id: int) -> bytes:
+        states = self._states.get(household_id, {})
+        return encode_event("snapshot", {"systems": list(states.values())})
+
+    def _send(self, household_id: int, message: bytes):
+        for queue in list(self._subscribers.get(household_id, ())):
+            try:
+                queue.put_nowait(message)
+            except asyncio.QueueFull:
+                STREAM_DROPPED.inc()
+                self.unsubscribe(household_id, queue)
+                while not queue.empty():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+    def publish(self, household_id: int, state: dict):
+        """Sends the fields of `state` that changed since the last publish"""
+        system_id = state["system_id"]
+        states = self._states.setdefault(household_id, {})
+        previous = states.get(system_id, {})
+        changed = {k: v for k, v in state.items() if previous.get(k) != v}
+        if not changed:
+            return
+        states[system_id] = state
+        if household_id in self._subscribers:
+            STREAM_EVENTS.labels("delta").inc()
+            self._send(
+                household_id, encode_event("delta", {"system_id": system_id, **changed})
+            )
+
+    def remove(self, household_id: int, system_id: int):
+        states = self._states.get(household_id, {})
+        if states.pop(system_id, None) is None:
+            return
+        if household_id in self._subscribers:
+            STREAM_EVENTS.labels("removed").inc()
+            self._send(household_id, encode_event("removed", {"system_id": system_id}))
+
+    def close(self):
+        """Ends every stream, e.g. on shutdown"""
+        for household_id, queues in list(self._subscribers.items()):
+            for queue in list(queues):
+                self.unsubscribe(household_id, queue)
+                if queue.full():
+                    queue.get_nowait()
+                queue.put_nowait(None)
+
+
+state_broadcaster = StateBroadcaster()
+
+Gauge("heating_stream_clients", "Connected state stream clients").set_function(
+    lambda: state_broadcaster.subscribers
+)
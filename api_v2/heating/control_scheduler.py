@@ -0,0 +1,216 @@
+import asyncio
+import heapq
+import random
+import time
+from typing import Dict, List, Optional, Tuple
+
+from api_v2.logger import get_logger
+from api_v2.metrics import Counter, Gauge, Histogram
+from api_v2.settings import (
+    GLOBAL_LOG_LEVEL,
+    EVENT_DRIVEN_CONTROL,
+    CONTROL_MAX_CONCURRENT_TICKS,
+    SLOW_TICK_WARNING,
+)
+
+logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
+
+TICK_SECONDS = Histogram(
+    "heating_tick_duration_seconds", "Time taken by one control tick", ("system_id",)
+)
+TICK_LAG_SECONDS = Histogram(
+    "heating_tick_lag_seconds",
+    "How late a control tick started after it was due",
+    ("system_id",),
+)
+TICK_ERRORS = Counter(
+    "heating_tick_errors", "Control ticks that raised an exception", ("system_id",)
+)
+SYSTEMS = Gauge("heating_systems", "Heating systems the control loop is driving")
+
+
+class TickStats:
+    __slots__ = ("ticks", "errors", "last_duration", "max_duration", "last_lag")
+
+    def __init__(self):
+        self.ticks = 0
+        self.errors = 0
+        self.last_duration = None
+        self.max_duration = 0.0
+        self.last_lag = None
+
+    def record(self, duration: float, lag: float, failed: bool):
+        self.ticks += 1
+        self.errors += failed
+        self.last_duration = duration
+        self.max_duration = max(self.max_duration, duration)
+        self.last_lag = lag
+
+    def dict(self) -> dict:
+        return {key: getattr(self, key) for key in self.__slots__}
+
+
+class ControlScheduler:
+    """Runs every HeatingSystem's main_task from one task. Due times live in
+    a heap; systems start at a random phase within their interval so they
+    don't all hit sensors and GPIO at once, and a semaphore caps how many
+    ticks run concurrently."""
+
+    def __init__(self, max_concurrent: int = CONTROL_MAX_CONCURRENT_TICKS):
+        self._heap: List[Tuple[float, int, int]] = []
+        self._seq = 0
+        self._systems = {}
+        self._intervals: Dict[int, float] = {}
+        self._due: Dict[int, float] = {}
+        self._running = set()
+        self._woken = set()
+        self._waiters: Dict[int, List[asyncio.Future]] = {}
+        self._stats: Dict[int, TickStats] = {}
+        self._ticks = set()
+        self._max_concurrent = max_concurrent
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._changed: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._semaphore = asyncio.Semaphore(self._max_concurrent)
+            self._changed = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for tick in list(self._ticks):
+            tick.cancel()
+
+    def add(self, system, interval: float):
+        self.start()
+        system_id = system.system_id
+        self._systems[system_id] = system
+        self._intervals[system_id] = interval
+        self._stats[system_id] = TickStats()
+        SYSTEMS.set(len(self._systems))
+        # first tick straight away, later ones spread across the interval
+        self._schedule(system_id, time.monotonic())
+
+    def remove(self, system_id: int):
+        self._systems.pop(system_id, None)
+        self._intervals.pop(system_id, None)
+        self._due.pop(system_id, None)
+        self._stats.pop(system_id, None)
+        self._woken.discard(system_id)
+        self._release(self._waiters.pop(system_id, []))
+        SYSTEMS.set(len(self._systems))
+        for metric in (TICK_SECONDS, TICK_LAG_SECONDS, TICK_ERRORS):
+            metric.remove(system_id)
+
+    def wake(self, system_id: int):
+        if system_id in self._running:
+            self._woken.add(system_id)
+        elif system_id in self._systems:
+            self._schedule(system_id, time.monotonic())
+
+    async def run_now(self, system_id: int, timeout: float):
+        """Wakes the system and waits, up to `timeout`, for the tick that
+        starts after this call to finish"""
+        if system_id not in self._systems:
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(system_id, []).append(waiter)
+        self.wake(system_id)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"Tick for system {system_id} not done in {timeout}s")
+
+    @staticmethod
+    def _release(waiters: List[asyncio.Future]):
+        for waiter in waiters:
+            if not waiter.done():
+                waiter.set_result(None)
+
+    def stats(self, system_id: int) -> Optional[dict]:
+        stats = self._stats.get(system_id)
+        if stats is None:
+            return None
+        return {**stats.dict(), "running": system_id in self._running}
+
+    def _schedule(self, system_id: int, due: float):
+        self._due[system_id] = due
+        self._seq += 1
+        heapq.heappush(self._heap, (due, self._seq, system_id))
+        if self._changed is not None:
+            self._changed.set()
+
+    def _next_due(self, system_id: int, first: bool) -> float:
+        interval = self._intervals[system_id]
+        if first:
+            return time.monotonic() + random.uniform(0, interval)
+        wait = interval
+        if EVENT_DRIVEN_CONTROL:
+            wait = self._systems[system_id].seconds_until_next_tick(interval)
+        return time.monotonic() + wait
+
+    async def _run(self):
+        while True:
+            self._changed.clear()
+            now = time.monotonic()
+            while self._heap and self._heap[0][0] <= now:
+                due, _, system_id = heapq.heappop(self._heap)
+                if self._due.get(system_id) != due:
+                    continue  # superseded by a later _schedule or removed
+                del self._due[system_id]
+                self._running.add(system_id)
+                tick = asyncio.ensure_future(self._tick(system_id, due))
+                self._ticks.add(tick)
+                tick.add_done_callback(self._ticks.discard)
+            timeout = self._heap[0][0] - now if self._heap else None
+            try:
+                await asyncio.wait_for(self._changed.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _tick(self, system_id: int, due: float):
+        system = self._systems.get(system_id)
+        stats = self._stats.get(system_id)
+        failed = False
+        waiters = []
+        try:
+            async with self._semaphore:
+                if system is None or self._systems.get(system_id) is not system:
+                    return
+                waiters = self._waiters.pop(system_id, [])
+                started = time.monotonic()
+                try:
+                    await system.main_task()
+                except Exception as e:
+                    failed = True
+                    logger.exception(f"Tick failed for system {system_id}: {e}")
+                duration = time.monotonic() - started
+        finally:
+            self._running.discard(system_id)
+            self._release(waiters)
+        if self._systems.get(system_id) is not system:
+            return  # removed (or restarted) while ticking
+        first = stats.ticks == 0
+        stats.record(duration, started - due, failed)
+        TICK_SECONDS.labels(system_id).observe(duration)
+        TICK_LAG_SECONDS.labels(system_id).observe(max(started - due, 0.0))
+        if failed:
+            TICK_ERRORS.labels(system_id).inc()
+        if duration > SLOW_TICK_WARNING:
+            logger.warning(f"Slow tick for system {system_id}: {duration:.2f}s")
+        if system_id in self._woken:
+            self._woken.discard(system_id)
+            self._schedule(system_id, time.monotonic())
+        else:
+            self._schedule(system_id, self._next_due(system_id, first))
+
+
+control_scheduler = ControlScheduler()
@@ -0,0 +1,93 @@
+import asyncio
+import math
+import random
+import time
+from typing import Dict, Optional
+
+from aiohttp import web
+
+
+class FakeSensor:
+    """One simulated BME280 node; temperature follows a slow daily-ish wave
+    plus a random walk, so thermostats actually switch relays"""
+
+    def __init__(self, base_temperature: float, drift: float):
+        self.base_temperature = base_temperature
+        self.drift = drift
+        self.offset = 0.0
+        self.phase = random.uniform(0, 2 * math.pi)
+        self.requests = 0
+
+    def reading(self) -> dict:
+        self.requests += 1
+        self.offset += random.gauss(0, self.drift)
+        self.offset = max(-5.0, min(5.0, self.offset))
+        wave = 2 * math.sin(time.monotonic() / 600 + self.phase)
+        return {
+            "temperature": round(self.base_temperature + wave + self.offset, 2),
+            "pressure": round(1013 + random.gauss(0, 1), 2),
+            "humidity": round(50 + random.gauss(0, 2), 2),
+        }
+
+
+class FakeSensorFleet:
+    """Local HTTP server speaking the same protocol as microcontroller/boot.py:
+    any GET returns {"temperature", "pressure", "humidity"} as JSON. Each
+    sensor lives at /sensor/<n>; latency, jitter and failures are simulated."""
+
+    def __init__(
+        self,
+        sensors: int,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        failure_rate: float = 0.0,
+        base_temperature: float = 5.0,
+        drift: float = 0.05,
+        close_connections: bool = True,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.failure_rate = failure_rate
+        self.close_connections = close_connections
+        self.host = host
+        self.port = port
+        self.failures = 0
+        self.sensors: Dict[int, FakeSensor] = {
+            n: FakeSensor(base_temperature, drift) for n in range(sensors)
+        }
+        self._runner: Optional[web.AppRunner] = None
+
+    def url(self, n: int) -> str:
+        return f"http://{self.host}:{self.port}/sensor/{n}"
+
+    @property
+    def requests(self) -> int:
+        return sum(sensor.requests for sensor in self.sensors.values())
+
+    async def handle(self, request: web.Request) -> web.Response:
+        sensor = self.sensors.get(int(request.match_info["n"]))
+        if sensor is None:
+            raise web.HTTPNotFound()
+        delay = max(0.0, random.gauss(self.latency, self.jitter))
+        await asyncio.sleep(delay)
+        if random.random() < self.failure_rate:
+            self.failures += 1
+            raise web.HTTPInternalServerError()
+        headers = {"Connection": "close"} if self.close_connections else None
+        return web.json_response(sensor.reading(), headers=headers)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/sensor/{n}", self.handle)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, self.host, self.port)
+        await site.start()
+        self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
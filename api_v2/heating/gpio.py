@@ -0,0 +1,223 @@
+import asyncio
+import struct
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import pigpio
+
+from .fake_pi import fake_pi
+from ..logger import get_logger
+from api_v2.settings import (
+    GLOBAL_LOG_LEVEL,
+    GPIO_BACKEND,
+    PIGPIOD_PORT,
+    GPIO_COMMAND_TIMEOUT,
+)
+
+logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
+
+
+class GPIOBackend:
+    """Async interface to the GPIO pins of one Raspberry Pi"""
+
+    host: Optional[str] = None
+
+    async def read(self, pin: int) -> int:
+        raise NotImplementedError
+
+    async def write(self, pin: int, level: int):
+        raise NotImplementedError
+
+    async def read_bank(self) -> int:
+        """Levels of GPIO 0-31 as a bitmask"""
+        raise NotImplementedError
+
+    @property
+    def connected(self) -> bool:
+        return True
+
+    async def close(self):
+        """Drops the connection; the next command opens a new one"""
+
+
+class FakeGPIO(GPIOBackend):
+    """In-memory pins on top of fake_pi, counting every call it receives"""
+
+    def __init__(self, host: Optional[str] = None):
+        self.host = host
+        self.pi = fake_pi()
+        self.levels = {}
+        self.calls = {"read": 0, "write": 0, "read_bank": 0}
+
+    async def read(self, pin: int) -> int:
+        self.calls["read"] += 1
+        return self.levels.get(pin, self.pi.read(pin))
+
+    async def write(self, pin: int, level: int):
+        self.calls["write"] += 1
+        self.pi.write(pin, level)
+        self.levels[pin] = level
+
+    async def read_bank(self) -> int:
+        self.calls["read_bank"] += 1
+        bank = 0
+        for pin in range(32):
+            bank |= (self.levels.get(pin, self.pi.read(pin)) & 1) << pin
+        return bank
+
+
+class ExecutorPigpioGPIO(GPIOBackend):
+    """The pigpio library's blocking socket calls, run on a worker thread.
+    The connection is opened lazily on that thread and again after close()"""
+
+    def __init__(self, host: Optional[str] = None):
+        self.host = host
+        self.pi = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _connected_pi(self, executor: ThreadPoolExecutor):
+        if self.pi is None:
+            pi = pigpio.pi() if self.host is None else pigpio.pi(self.host)
+            if not pi.connected:
+                pi.stop()
+                raise ConnectionError(f"Can't connect to pigpiod on {self.host}")
+            if self._executor is not executor:
+                pi.stop()  # closed while connecting
+                raise ConnectionError(f"Connection to {self.host} was closed")
+            self.pi = pi
+        return self.pi
+
+    async def _call(self, method: str, *args):
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=1, thread_name_prefix=f"pigpio-{self.host or 'local'}"
+            )
+        executor = self._executor
+        loop = asyncio.get_running_loop()
+        return await asyncio.wait_for(
+            loop.run_in_executor(
+                executor, lambda: getattr(self._connected_pi(executor), method)(*args)
+            ),
+            GPIO_COMMAND_TIMEOUT,
+        )
+
+    @property
+    def connected(self) -> bool:
+        return self.pi is not None and bool(self.pi.connected)
+
+    async def read(self, pin: int) -> int:
+        return await self._call("read", pin)
+
+    async def write(self, pin: int, level: int):
+        await self._call("write", pin, level)
+
+    async def read_bank(self) -> int:
+        return await self._call("read_bank_1")
+
+    async def close(self):
+        """Drops the worker without waiting for it: a call that timed out may
+        still be hung on it, so the connection is stopped on a thread of its
+        own rather than queued behind that call"""
+        executor, pi = self._executor, self.pi
+        self._executor = self.pi = None
+        if executor is not None:
+            executor.shutdown(wait=False)
+        if pi is not None:
+            threading.Thread(
+                target=pi.stop, name=f"pigpio-stop-{self.host or 'local'}", daemon=True
+            ).start()
+
+
+class PigpiodError(Exception):
+    pass
+
+
+class AsyncPigpiodGPIO(GPIOBackend):
+    """Speaks the pigpiod socket protocol directly over an asyncio stream.
+    Each command is four little-endian uint32s (cmd, p1, p2, p3) and the
+    daemon replies with the same 16 bytes, the last word being the result."""
+
+    CMD_READ = 3
+    CMD_WRITE = 4
+    CMD_BR1 = 10
+
+    def __init__(self, host: Optional[str] = None, port: int = PIGPIOD_PORT):
+        self.host = host
+        self.port = port
+        self._reader: Optional[asyncio.StreamReader] = None
+        self._writer: Optional[asyncio.StreamWriter] = None
+        self._lock = asyncio.Lock()
+
+    async def _connect(self):
+        self._reader, self._writer = await asyncio.wait_for(
+            asyncio.open_connection(self.host or "localhost", self.port),
+            GPIO_COMMAND_TIMEOUT,
+        )
+
+    async def _command(self, cmd: int, p1: int = 0, p2: int = 0) -> int:
+        async with self._lock:
+            try:
+                if self._writer is None:
+                    await self._connect()
+                self._writer.write(struct.pack("<IIII", cmd, p1, p2, 0))
+                await self._writer.drain()
+                response = await asyncio.wait_for(
+                    self._reader.readexactly(16), GPIO_COMMAND_TIMEOUT
+                )
+            except BaseException:
+                # a half-read reply would desync every later command
+                self._abort()
+                raise
+        return struct.unpack("<12sI", response)[1]
+
+    async def _checked_command(self, cmd: int, p1: int = 0, p2: int = 0) -> int:
+        result = await self._command(cmd, p1, p2)
+        if result & 0x80000000:
+            result -= 1 << 32
+        if result < 0:
+            raise PigpiodError(f"pigpiod command {cmd} failed ({result})")
+        return result
+
+    async def read(self, pin: int) -> int:
+        return await self._checked_command(self.CMD_READ, pin)
+
+    async def write(self, pin: int, level: int):
+        await self._checked_command(self.CMD_WRITE, pin, level)
+
+    async def read_bank(self) -> int:
+        return await self._command(self.CMD_BR1)
+
+    @property
+    def connected(self) -> bool:
+        return self._writer is not None and not self._writer.is_closing()
+
+    def _abort(self):
+        if self._writer is not None:
+            self._writer.close()
+        self._reader = self._writer = None
+
+    async def close(self):
+        async with self._lock:
+            writer = self._writer
+            self._abort()
+            if writer is not None:
+                try:
+                    await writer.wait_closed()
+                except OSError:
+                    pass
+
+
+GPIO_BACKENDS = {
+    "fake": FakeGPIO,
+    "executor": ExecutorPigpioGPIO,
+    "asyncio": AsyncPigpiodGPIO,
+}
+
+
+def create_gpio_backend(
+    host: Optional[str] = None, test: bool = False
+) -> GPIOBackend:
+    backend = GPIO_BACKENDS["fake" if test else GPIO_BACKEND]
+    logger.debug(f"Using {backend.__name__} for GPIO on {host or 'localhost'}")
+    return backend(host)
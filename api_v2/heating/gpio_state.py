@@ -0,0 +1,256 @@
+import asyncio
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+from .gpio import GPIOBackend, create_gpio_backend
+from ..logger import get_logger
+from ..metrics import Counter, Gauge, Histogram
+from api_v2.settings import (
+    GLOBAL_LOG_LEVEL,
+    GPIO_REFRESH_INTERVAL,
+    GPIO_RECONNECT_MIN_DELAY,
+    GPIO_RECONNECT_MAX_DELAY,
+    GPIO_HEALTH_CHECK_INTERVAL,
+    GPIO_IDLE_TIMEOUT,
+)
+
+logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
+
+BANK_1_PINS = 32
+
+GPIO_SECONDS = Histogram(
+    "gpio_operation_duration_seconds",
+    "Time taken by GPIO backend calls",
+    ("host", "operation"),
+)
+GPIO_ERRORS = Counter(
+    "gpio_operation_errors", "GPIO backend calls that failed", ("host", "operation")
+)
+
+
+class GPIOUnavailable(Exception):
+    pass
+
+
+class GPIOHost:
+    """Shadow copy of the pin levels on one Pi, shared by every system wired
+    to it. Writes go through to the backend and update the shadow; reads are
+    answered from the shadow, which is refreshed with a single bank read at
+    most once per GPIO_REFRESH_INTERVAL."""
+
+    def __init__(
+        self, backend: GPIOBackend, refresh_interval: float = GPIO_REFRESH_INTERVAL
+    ):
+        self.backend = backend
+        self.refresh_interval = refresh_interval
+        self.levels: Dict[int, int] = {}
+        self.refreshed_at: Optional[float] = None
+        self.failures = 0
+        self.reconnects = 0
+        self.last_error: Optional[str] = None
+        self._backoff = 0.0
+        self._retry_at: Optional[float] = None
+        self._pins: Set[int] = set()
+        self._lock = asyncio.Lock()
+        self._teardown: Optional[asyncio.Task] = None
+
+    @property
+    def host(self) -> Optional[str]:
+        return self.backend.host
+
+    def watch(self, pin: int):
+        self._pins.add(pin)
+
+    def unwatch(self, pin: int):
+        self._pins.discard(pin)
+        self.levels.pop(pin, None)
+
+    async def _io(self, operation, *args):
+        """Runs a backend call, dropping the connection on failure and
+        refusing further calls until an exponential backoff has passed"""
+        if self._retry_at is not None and time.monotonic() < self._retry_at:
+            raise GPIOUnavailable(
+                f"GPIO on {self.host or 'localhost'} unavailable ({self.last_error})"
+            )
+        host = self.host or "localhost"
+        started = time.perf_counter()
+        try:
+            result = await operation(*args)
+        except Exception as e:
+            GPIO_ERRORS.labels(host, operation.__name__).inc()
+            self.failures += 1
+            self.last_error = f"{e.__class__.__name__}: {e}"
+            self._backoff = min(
+                max(self._backoff * 2, GPIO_RECONNECT_MIN_DELAY),
+                GPIO_RECONNECT_MAX_DELAY,
+            )
+            self._retry_at = time.monotonic() + self._backoff
+            logger.error(
+                f"GPIO on {self.host or 'localhost'} failed ({self.last_error}), "
+                f"reconnecting in {self._backoff:.0f}s"
+            )
+            # torn down in the background: _io may be running under _lock,
+            # which every system on this host waits for
+            self._teardown = asyncio.ensure_future(self._close_backend())
+            raise
+        finally:
+            GPIO_SECONDS.labels(host, operation.__name__).observe(
+                time.perf_counter() - started
+            )
+        if self._retry_at is not None:
+            self.reconnects += 1
+            logger.warning(f"GPIO on {self.host or 'localhost'} reconnected")
+        self._backoff = 0.0
+        self._retry_at = None
+        return result
+
+    async def _close_backend(self):
+        try:
+            await self.backend.close()
+        except Exception as e:
+            logger.error(f"Closing GPIO on {self.host or 'localhost'} failed: {e}")
+
+    @property
+    def stale(self) -> bool:
+        return (
+            self.refreshed_at is None
+            or time.monotonic() - self.refreshed_at > self.refresh_interval
+        )
+
+    async def refresh(self, force: bool = False):
+        async with self._lock:
+            if not (force or self.stale):
+                return
+            bank = await self._io(self.backend.read_bank)
+            for pin in self._pins:
+                if pin < BANK_1_PINS:
+                    level = (bank >> pin) & 1
+                else:
+                    level = await self._io(self.backend.read, pin)
+                known = self.levels.get(pin)
+                if known is not None and known != level:
+                    logger.warning(
+                        f"GPIO {pin} on {self.host or 'localhost'} changed "
+                        f"externally ({known} -> {level})"
+                    )
+                self.levels[pin] = level
+            self.refreshed_at = time.monotonic()
+
+    def peek(self, pin: int) -> Optional[int]:
+        """Last known level without any I/O"""
+        return self.levels.get(pin)
+
+    async def read(self, pin: int) -> int:
+        self.watch(pin)
+        if self.stale or pin not in self.levels:
+            if pin not in self.levels:
+                self.refreshed_at = None
+            await self.refresh()
+        return self.levels[pin]
+
+    async def write(self, pin: int, level: int):
+        await self._io(self.backend.write, pin, level)
+        self.levels[pin] = level
+
+    def stats(self) -> dict:
+        return {
+            "host": self.host or "localhost",
+            "backend": self.backend.__class__.__name__,
+            "connected": self.backend.connected,
+            "pins": sorted(self._pins),
+            "failures": self.failures,
+            "reconnects": self.reconnects,
+            "last_error": self.last_error,
+            "backoff": self._backoff,
+        }
+
+
+class GPIOHostPool:
+    """Hands out one shared, reference-counted GPIOHost per Pi. A background
+    task bank-reads every host in use as a health check and closes hosts
+    nobody has used for GPIO_IDLE_TIMEOUT."""
+
+    def __init__(self):
+        self._hosts: Dict[Tuple[Optional[str], bool], GPIOHost] = {}
+        self._refs: Dict[Tuple[Optional[str], bool], int] = {}
+        self._idle_since: Dict[Tuple[Optional[str], bool], float] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    def acquire(self, host: Optional[str] = None, test: bool = False) -> GPIOHost:
+        key = (host, test)
+        if key not in self._hosts:
+            self._hosts[key] = GPIOHost(create_gpio_backend(host, test))
+        self._refs[key] = self._refs.get(key, 0) + 1
+        self._idle_since.pop(key, None)
+        return self._hosts[key]
+
+    def release(self, gpio_host: GPIOHost, pin: Optional[int] = None):
+        for key, candidate in self._hosts.items():
+            if candidate is gpio_host:
+                break
+        else:
+            return
+        if pin is not None:
+            gpio_host.unwatch(pin)
+        self._refs[key] -= 1
+        if self._refs[key] <= 0:
+            self._idle_since[key] = time.monotonic()
+
+    async def close_idle(self, max_idle: float = GPIO_IDLE_TIMEOUT):
+        now = time.monotonic()
+        for key, since in list(self._idle_since.items()):
+            if now - since >= max_idle:
+                logger.info(f"Closing idle GPIO connection to {key[0] or 'localhost'}")
+                await self._close(key)
+
+    async def _close(self, key):
+        gpio_host = self._hosts.pop(key)
+        self._refs.pop(key, None)
+        self._idle_since.pop(key, None)
+        await gpio_host.backend.close()
+
+    async def health_check(self):
+        for key, gpio_host in list(self._hosts.items()):
+            if self._refs.get(key):
+                try:
+                    await gpio_host.refresh(force=True)
+                except Exception:
+                    pass  # logged and backed off by GPIOHost
+
+    async def _maintain(self, interval: float):
+        while True:
+            await asyncio.sleep(interval)
+            await self.health_check()
+            await self.close_idle()
+
+    def start(self, interval: float = GPIO_HEALTH_CHECK_INTERVAL):
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(
+                self._maintain(interval)
+            )
+
+    async def close_all(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        for key in list(self._hosts):
+            await self._close(key)
+
+    def hosts(self) -> List[GPIOHost]:
+        return list(self._hosts.values())
+
+    def stats(self) -> list:
+        return [
+            {**gpio_host.stats(), "refs": self._refs.get(key, 0)}
+            for key, gpio_host in self._hosts.items()
+        ]
+
+
+gpio_hosts = GPIOHostPool()
+
+Gauge("gpio_hosts", "GPIO hosts held by the pool").set_function(
+    lambda: len(gpio_hosts._hosts)
+)
+Gauge("gpio_connections", "Open connections to GPIO hosts").set_function(
+    lambda: sum(h.backend.connected for h in gpio_hosts._hosts.values())
+)
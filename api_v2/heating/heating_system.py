@@ -1,27 +1,52 @@
-import asyncio
-import json
-from json import JSONDecodeError
-
+import time
+import weakref
 from typing import Optional
 
-import pigpio
-import os
-from pathlib import Path
-from .fake_pi import fake_pi
-from .manage_times import check_times, get_times, new_time
+from .broadcaster import state_broadcaster
+from .gpio_state import gpio_hosts
+from .readings import CachedReading
+from .control_scheduler import control_scheduler
+from .program_state import program_state
+from .manage_times import get_schedule, new_time
+from .schedule import schedules
+from .telemetry import TelemetryBuffer
+from .telemetry_store import telemetry_store
+from ..metrics import Counter, Gauge, Histogram, timed_phase
 from ..models import PHeatingPeriod
 from ..utils import get_json
 from ..logger import get_logger
-from api_v2.settings import GLOBAL_LOG_LEVEL
+from api_v2.settings import (
+    GLOBAL_LOG_LEVEL,
+    PROGRAM_CHANGE_TIMEOUT,
+    SENSOR_READING_TTL,
+    SCHEDULE_EDGE_MARGIN,
+    TELEMETRY_CAPACITY,
+)
 
 logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
 
 
-CONFIG_PATH = Path(os.path.dirname(__file__))
-CONFIG_FILE = CONFIG_PATH / "config.json"
-DEFAULT_CONFIG = {"program_on": []}
 DEFAULT_PROGRAM_LOOP_INTERVAL = 60
 
+SENSOR_SECONDS = Histogram(
+    "sensor_fetch_duration_seconds",
+    "Time taken to fetch a sensor reading",
+    ("system_id",),
+)
+SENSOR_ERRORS = Counter(
+    "sensor_fetch_errors", "Sensor reading fetches that failed", ("system_id",)
+)
+RELAY_SWITCHES = Counter(
+    "heating_relay_switches", "Relay switches by new state", ("system_id", "state")
+)
+
+# every HeatingSystem still alive, stopped or not, to spot instances that
+# outlive kill_system
+_instances = weakref.WeakSet()
+Gauge(
+    "heating_system_instances", "HeatingSystem objects alive in memory"
+).set_function(lambda: len(_instances))
+
 
 class HeatingSystem:
     THRESHOLD = 0.2
@@ -42,51 +67,56 @@ class HeatingSystem:
             f"Creating new instance of HeatingSystem\n"
             f"(GPIO_PIN: {gpio_pin}, TEMPERATURE_URL: {temperature_url})"
         )
-        if test:
-            self.pi = fake_pi()
-        elif raspberry_pi_ip is None:
-            self.pi = pigpio.pi()
-        else:
-            self.pi = pigpio.pi(raspberry_pi_ip)
+        self.gpio = gpio_hosts.acquire(raspberry_pi_ip, test)
+        self.gpio.watch(gpio_pin)
         self.gpio_pin = gpio_pin
         self.temperature_url = temperature_url
         self.system_id = system_id
         self.household_id = household_id
         self.measurements = None
+        self.readings = CachedReading(self.fetch_measurements, SENSOR_READING_TTL)
+        self.telemetry = TelemetryBuffer(TELEMETRY_CAPACITY)
+        self.last_relay_state = None
         self.current_period = None
         self.thermostat_logging_flag = None
         self.errors = {"temporary": False, "initial": False}
-        self.config = self.init_config()
-        self.program_on = self.system_was_on()
-        loop = asyncio.get_running_loop()
-        loop.create_task(self.main_loop(interval))
+        self.program_on = program_state.is_on(system_id)
+        control_scheduler.add(self, interval)
+        _instances.add(self)
 
-    @staticmethod
-    def init_config():
+    async def fetch_measurements(self) -> dict:
+        started = time.perf_counter()
         try:
-            with open(CONFIG_FILE, "r") as c:
-                config = json.load(c)
-        except (FileNotFoundError, JSONDecodeError):
-            with open(CONFIG_FILE, "w") as c:
-                json.dump(DEFAULT_CONFIG, c)
-        return config
-
-    def system_was_on(self):
-        return self.system_id in map(int, self.config["program_on"])
+            return await get_json(self.temperature_url)
+        except Exception:
+            SENSOR_ERRORS.labels(self.system_id).inc()
+            raise
+        finally:
+            SENSOR_SECONDS.labels(self.system_id).observe(
+                time.perf_counter() - started
+            )
 
-    async def get_measurements(self) -> dict:
+    async def get_measurements(self, max_age: Optional[float] = None) -> dict:
         try:
-            res = await get_json(self.temperature_url)
+            with timed_phase("sensor"):
+                res = await self.readings.get(max_age)
             if res.get("temperature"):
                 self.reset_error_state()
             return res
         except Exception as e:
-            self.handle_request_errors(e)
+            await self.handle_request_errors(e)
         return {}
 
-    def handle_request_errors(self, e):
+    async def handle_request_errors(self, e):
         log_msg = None
-        self.switch_off_relay()
+        try:
+            await self.switch_off_relay()
+        except Exception as gpio_error:
+            # keep get_measurements from raising; the next tick retries
+            logger.error(
+                f"Could not switch off relay for system {self.system_id}: "
+                f"{gpio_error.__class__.__name__}: {gpio_error}"
+            )
         if self.measurements == {}:
             if self.errors["initial"]:
                 return
@@ -116,10 +146,17 @@ class HeatingSystem:
         temp = self.measurements.get("temperature")
         return float(temp) if temp is not None else None
 
+    def is_on_level(self, state: int) -> bool:
+        return not state if self.PIN_ON_STATE == 0 else not not state
+
     @property
     def relay_state(self) -> bool:
-        state = self.pi.read(self.gpio_pin)
-        return not state if self.PIN_ON_STATE == 0 else not not state
+        """Last known relay state from the host's shadow levels (no I/O)"""
+        state = self.gpio.peek(self.gpio_pin)
+        return False if state is None else self.is_on_level(state)
+
+    async def get_relay_state(self) -> bool:
+        return self.is_on_level(await self.gpio.read(self.gpio_pin))
 
     @property
     def too_cold(self) -> Optional[bool]:
@@ -132,15 +169,17 @@ class HeatingSystem:
         )
         return self.temperature <= self.current_period.target - self.THRESHOLD
 
-    def switch_on_relay(self):
-        if not self.relay_state:
+    async def switch_on_relay(self):
+        if not await self.get_relay_state():
             logger.debug(f"Switching on relay {self.gpio_pin=}")
-            self.pi.write(self.gpio_pin, self.PIN_ON_STATE)
+            await self.gpio.write(self.gpio_pin, self.PIN_ON_STATE)
+            RELAY_SWITCHES.labels(self.system_id, "on").inc()
 
-    def switch_off_relay(self):
-        if self.relay_state:
+    async def switch_off_relay(self):
+        if await self.get_relay_state():
             logger.debug(f"Switching off relay {self.gpio_pin=}")
-            self.pi.write(self.gpio_pin, 1 if self.PIN_ON_STATE == 0 else 0)
+            await self.gpio.write(self.gpio_pin, 1 if self.PIN_ON_STATE == 0 else 0)
+            RELAY_SWITCHES.labels(self.system_id, "off").inc()
 
     async def thermostat_control(self):
         self.measurements = await self.get_measurements()
@@ -148,7 +187,7 @@ class HeatingSystem:
             check = self.too_cold
         except Exception as e:
             logger.warning(e)
-            self.switch_off_relay()
+            await self.switch_off_relay()
             logger.info(f"Error getting temperature {self.gpio_pin=}")
             return
         if self.thermostat_logging_flag is None:
@@ -161,7 +200,7 @@ class HeatingSystem:
                         f"switching on relay [pin {self.gpio_pin}]"
                     )
                 self.thermostat_logging_flag = True
-            self.switch_on_relay()
+            await self.switch_on_relay()
         elif not check:
             if self.thermostat_logging_flag is True:
                 if self.current_period is not None:
@@ -170,7 +209,7 @@ class HeatingSystem:
                         f"switching off relay [pin {self.gpio_pin}]"
                     )
                 self.thermostat_logging_flag = False
-            self.switch_off_relay()
+            await self.switch_off_relay()
 
     async def main_task(self):
         logger.debug(f"Performing main task {self.gpio_pin=}")
@@ -179,31 +218,88 @@ class HeatingSystem:
         else:
             self.current_period = None
         await self.thermostat_control()
+        self.record_telemetry()
+        state_broadcaster.publish(self.household_id, self.state())
+
+    def record_telemetry(self):
+        now = time.time()
+        relay_state = self.relay_state
+        target = (
+            self.current_period.target if self.current_period else self.MINIMUM_TEMP
+        )
+        self.telemetry.append(now, self.measurements, relay_state, target)
+        telemetry_store.record(
+            self.system_id, now, self.measurements, relay_state, target
+        )
+        if relay_state != self.last_relay_state:
+            telemetry_store.record_transition(self.system_id, now, relay_state)
+            self.last_relay_state = relay_state
 
-    async def main_loop(self, interval: int = 60):
-        logger.debug(f"Main loop starting {self.gpio_pin=}")
-        while True:
-            await self.main_task()
-            await asyncio.sleep(interval)
+    def state(self) -> dict:
+        """What /v2/heating/stream clients see of this system"""
+        period = self.current_period
+        age = self.readings.age
+        return {
+            "system_id": self.system_id,
+            "sensor_readings": self.measurements or {},
+            # rounded so the same reading always gives the same time
+            "reading_time": round(time.time() - age, 1) if age is not None else None,
+            "relay_on": self.relay_state,
+            "program_on": self.program_on,
+            "target": period.target if period else self.MINIMUM_TEMP,
+            "period": (
+                {
+                    "period_id": period.period_id,
+                    "time_on": period.time_on,
+                    "time_off": period.time_off,
+                }
+                if period
+                else None
+            ),
+        }
+
+    def seconds_until_next_tick(self, interval: int) -> float:
+        wait = interval
+        schedule = schedules.get(self.system_id)
+        if self.program_on and schedule is not None:
+            minutes = schedule.minutes_to_next_boundary()
+            if minutes is not None:
+                wait = min(wait, minutes * 60 + SCHEDULE_EDGE_MARGIN)
+        return max(wait, 0)
+
+    def stop(self):
+        """Stops ticking, hands the GPIO connection back to the pool and drops
+        this system's metric series"""
+        control_scheduler.remove(self.system_id)
+        gpio_hosts.release(self.gpio, self.gpio_pin)
+        state_broadcaster.remove(self.household_id, self.system_id)
+        SENSOR_SECONDS.remove(self.system_id)
+        SENSOR_ERRORS.remove(self.system_id)
+        for state in ("on", "off"):
+            RELAY_SWITCHES.remove(self.system_id, state)
+
+    def wake(self):
+        """Asks the control scheduler to run the next tick straight away"""
+        control_scheduler.wake(self.system_id)
 
     async def turn_program_on(self):
         self.program_on = True
         self.update_config()
         logger.info(f"Program on [pin {self.gpio_pin}]")
         self.thermostat_logging_flag = None
-        await self.main_task()
+        await control_scheduler.run_now(self.system_id, PROGRAM_CHANGE_TIMEOUT)
 
     async def turn_program_off(self):
         self.program_on = False
         self.update_config()
         self.current_period = None
         logger.info(f"Program off [pin {self.gpio_pin}]")
-        await self.main_task()
+        await control_scheduler.run_now(self.system_id, PROGRAM_CHANGE_TIMEOUT)
 
     async def get_current_time_period(self):
         logger.debug("Checking times")
-        times = await get_times(self.household_id)
-        self.current_period = await check_times(times, self.system_id)
+        schedule = await get_schedule(self.system_id, self.household_id)
+        self.current_period = schedule.current()
         if self.current_period is not None:
             logger.debug(
                 f"{self.current_period.time_on}->{self.current_period.time_off} ({self.current_period.target}°C)"
@@ -211,15 +307,9 @@ class HeatingSystem:
 
     async def new_time(self, period: PHeatingPeriod, user_id: int):
         _time = await new_time(self.household_id, period, user_id)
-        _check = await check_times([_time], self.system_id)
-        if _check:
-            self.current_period = _check
+        if self.program_on:
+            await self.get_current_time_period()
         return _time
 
     def update_config(self):
-        if self.program_on and not self.system_was_on():
-            self.config["program_on"].append(self.system_id)
-        elif not self.program_on and self.system_was_on():
-            self.config["program_on"].remove(self.system_id)
-        with open(CONFIG_FILE, "w") as f:
-            json.dump(self.config, f)
+        program_state.set(self.system_id, self.program_on)
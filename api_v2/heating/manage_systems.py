@@ -3,6 +3,7 @@ from typing import Iterable
 from fastapi import HTTPException
 
 from .heating_system import HeatingSystem
+from .schedule import schedules
 from .systems_in_memory import systems_in_memory
 from ..models import HeatingSystemModel, PHeatingSystemIn
 
@@ -56,9 +57,18 @@ async def get_all_systems_in_memory() -> Iterable[int]:
     return systems_in_memory.keys()
 
 
+def wake_household_systems(household_id: int):
+    for system in systems_in_memory.values():
+        if system.household_id == household_id:
+            system.wake()
+
+
 async def kill_system(system_id: int) -> bool:
     model = await get_system(system_id)
     model.activated = False
-    del systems_in_memory[system_id]
+    system = systems_in_memory.pop(system_id, None)
+    if system is not None:
+        system.stop()
+    schedules.invalidate(system_id)
     await model.save()
     return True
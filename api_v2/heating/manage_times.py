@@ -1,35 +1,51 @@
-import calendar
-from typing import Optional
-
-from api_v2.utils import BritishTime
-from api_v2.models import PHeatingPeriod, HeatingPeriod, HeatingPeriodModelCreator
-
-
-async def get_times(household_id: int, checking_period: Optional[int] = None):
-    qs = HeatingPeriod.filter(household_id=household_id)
-    if checking_period is not None:
-        qs = qs.exclude(period_id=checking_period)
-
-    return await HeatingPeriodModelCreator.from_queryset(qs)
+from typing import List, Optional, Tuple
+
+from tortoise.transactions import in_transaction
+
+from api_v2.models import (
+    Days,
+    PHeatingPeriod,
+    HeatingPeriod,
+    HeatingPeriodModelCreator,
+    HeatingSystemModel,
+    TimesBatch,
+)
+from .schedule import (
+    HouseholdPeriods,
+    ScheduledPeriod,
+    WeeklySchedule,
+    find_conflicts,
+    schedules,
+)
+
+
+async def get_times(
+    household_id: int, checking_period: Optional[int] = None
+) -> List[ScheduledPeriod]:
+    """The household's periods from one query over only the columns schedules
+    use, without fetching or validating related objects"""
+    rows = await HeatingPeriod.schedule_rows(household_id, checking_period)
+    return [ScheduledPeriod(**row) for row in rows]
+
+
+async def get_household_periods(household_id: int) -> HouseholdPeriods:
+    while schedules.get_household(household_id) is None:
+        generation = schedules.generation
+        periods = await get_times(household_id)
+        # a period written while we read would be missing from the index
+        if schedules.generation == generation:
+            schedules.set_household(HouseholdPeriods(household_id, periods))
+    return schedules.get_household(household_id)
 
 
 async def check_conflicts(household_id: int, period: PHeatingPeriod):
-    for p_db in [
-        p
-        for p in await get_times(household_id, period.period_id)
-        if p.heating_system.system_id == period.heating_system_id
-    ]:
-        start_1, start_2 = p_db.time_on, period.time_on
-        end_1, end_2 = p_db.time_off, period.time_off
-        if (start_1 < end_2) and (end_1 > start_2):
-            if len(
-                [
-                    day
-                    for day in period.days.dict().items()
-                    if day[1] and p_db.days[day[0]]
-                ]
-            ):
-                raise ValueError(f"Period overlaps with another")
+    index = await get_household_periods(household_id)
+    candidate = ScheduledPeriod.from_model(period)
+    stored = index.get(period.period_id) if period.period_id is not None else None
+    if stored is not None:
+        candidate = candidate._replace(all_systems=stored.all_systems)
+    if index.conflicts(candidate):
+        raise ValueError("Period overlaps with another")
 
 
 async def new_time(household_id: int, period: PHeatingPeriod, user_id: int):
@@ -39,6 +55,7 @@ async def new_time(household_id: int, period: PHeatingPeriod, user_id: int):
         created_by_id=user_id,
         **period.dict(exclude_unset=True),
     )
+    schedules.add_period(household_id, ScheduledPeriod.from_model(new_period))
     return await HeatingPeriodModelCreator.from_tortoise_orm(new_period)
 
 
@@ -47,28 +64,119 @@ async def update_time(household_id: int, period: PHeatingPeriod):
     p = await HeatingPeriod.get(period_id=period.period_id)
     p.__dict__.update(**period.dict(exclude_unset=True))
     await p.save()
+    schedules.add_period(household_id, ScheduledPeriod.from_model(p))
     return p
 
 
 async def delete_time(period_id: int):
     period = await HeatingPeriod.get(period_id=period_id)
     await period.delete()
+    schedules.remove_period(period.household_id, period_id)
     return {}
 
 
-def get_weekday():
-    weekday = BritishTime.today().weekday()
-    return calendar.day_name[weekday].lower()
+async def apply_times_batch(
+    household_id: int, batch: TimesBatch, user_id: int
+) -> Tuple[List[PHeatingPeriod], List[PHeatingPeriod], List[int]]:
+    """Validates every change against the others and the stored schedule in
+    one pass, then applies them all in a single transaction"""
+    index = await get_household_periods(household_id)
+    update_ids = [p.period_id for p in batch.update]
+    if None in update_ids:
+        raise ValueError("Updates need a period_id")
+    unknown = sorted(
+        period_id
+        for period_id in set(update_ids + batch.delete)
+        if index.get(period_id) is None
+    )
+    if unknown:
+        raise ValueError(f"Unknown periods: {unknown}")
+    if len(set(update_ids + batch.delete)) != len(update_ids) + len(batch.delete):
+        raise ValueError("A period can only be changed once per batch")
+    system_ids = {p.heating_system_id for p in batch.create + batch.update}
+    if system_ids:
+        known = await HeatingSystemModel.filter(
+            household_id=household_id, system_id__in=system_ids
+        ).values_list("system_id", flat=True)
+        unknown = sorted(system_ids - set(known))
+        if unknown:
+            raise ValueError(f"Unknown systems: {unknown}")
+
+    # the exact fields written below, so the cached periods match the rows
+    # (a day left out of `days` is stored, and so treated, as off)
+    updates = {
+        p.period_id: p.dict(exclude_unset=True, exclude={"period_id"})
+        for p in batch.update
+    }
+    creates = [p.dict(exclude_unset=True, exclude={"period_id"}) for p in batch.create]
+
+    updated = {
+        period_id: index.get(period_id)._replace(**fields)
+        for period_id, fields in updates.items()
+    }
+    # creates get placeholder ids below zero until the database assigns theirs
+    changed = list(updated.values()) + [
+        ScheduledPeriod(period_id=-1 - i, **fields) for i, fields in enumerate(creates)
+    ]
+    conflicts = find_conflicts(index, changed, set(updates) | set(batch.delete))
+    if conflicts:
+
+        def name(period_id: int) -> str:
+            return f"new #{-period_id}" if period_id < 0 else str(period_id)
+
+        pairs = ", ".join(f"{name(a)} and {name(b)}" for a, b in conflicts)
+        raise ValueError(f"Periods overlap: {pairs}")
+
+    created = []
+    async with in_transaction() as connection:
+        if batch.delete:
+            await HeatingPeriod.filter(
+                household_id=household_id, period_id__in=batch.delete
+            ).using_db(connection).delete()
+        for period_id, fields in updates.items():
+            await HeatingPeriod.filter(period_id=period_id).using_db(
+                connection
+            ).update(**fields)
+        for fields in creates:
+            created.append(
+                await HeatingPeriod.create(
+                    household_id=household_id,
+                    created_by_id=user_id,
+                    using_db=connection,
+                    **fields,
+                )
+            )
+
+    for period_id in batch.delete:
+        schedules.remove_period(household_id, period_id)
+    for period_id in updates:
+        schedules.add_period(household_id, updated[period_id])
+    created = [ScheduledPeriod.from_model(period) for period in created]
+    for period in created:
+        schedules.add_period(household_id, period)
+    return (
+        [response_period(period) for period in created],
+        [response_period(period) for period in updated.values()],
+        batch.delete,
+    )
+
+
+def response_period(period: ScheduledPeriod) -> PHeatingPeriod:
+    """The API form of a stored period with all seven days spelled out, since
+    Days would report the ones left out as on. Built without validation, as
+    stored periods were validated on the way in."""
+    fields = {field: getattr(period, field) for field in PHeatingPeriod.__fields__}
+    fields["days"] = Days.construct(
+        **{day: bool(period.days.get(day)) for day in Days.__fields__}
+    )
+    return PHeatingPeriod.construct(**fields)
 
 
-async def check_times(times, system_id):
-    weekday = get_weekday()
-    now = BritishTime.now().time()
-    for _time in sorted(times, key=lambda x: x.time_on):
-        if _time.heating_system.system_id == system_id or _time.all_systems:
-            for day, checked in _time.days.items():
-                if checked and day == weekday:
-                    time_on = BritishTime.strptime(_time.time_on, "%H:%M").time()
-                    time_off = BritishTime.strptime(_time.time_off, "%H:%M").time()
-                    if time_on < now < time_off:
-                        return _time
+async def get_schedule(system_id: int, household_id: int) -> WeeklySchedule:
+    while schedules.get(system_id) is None:
+        generation = schedules.generation
+        periods = await get_times(household_id)
+        # a period written while we read would be missing from the schedule
+        if schedules.generation == generation:
+            schedules.set(WeeklySchedule(system_id, household_id, periods))
+    return schedules.get(system_id)
@@ -0,0 +1,90 @@
+import asyncio
+import json
+import os
+from json import JSONDecodeError
+from pathlib import Path
+from typing import Optional, Set
+
+from ..logger import get_logger
+from api_v2.settings import GLOBAL_LOG_LEVEL, PROGRAM_STATE_WRITE_DELAY
+
+logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
+
+CONFIG_PATH = Path(os.path.dirname(__file__))
+CONFIG_FILE = CONFIG_PATH / "config.json"
+
+
+class ProgramState:
+    """Which systems have their program switched on, shared by every
+    HeatingSystem. Changes are coalesced for `delay` seconds and written
+    atomically on a worker thread."""
+
+    def __init__(
+        self, path: Path = CONFIG_FILE, delay: float = PROGRAM_STATE_WRITE_DELAY
+    ):
+        self.path = path
+        self.delay = delay
+        self._program_on: Set[int] = self._load()
+        self._pending: Optional[asyncio.TimerHandle] = None
+        # kept so the write isn't garbage collected and shutdown can await it
+        self._flush_task: Optional[asyncio.Task] = None
+        self._lock: Optional[asyncio.Lock] = None
+
+    def _load(self) -> Set[int]:
+        try:
+            with open(self.path, "r") as c:
+                return set(map(int, json.load(c)["program_on"]))
+        except (FileNotFoundError, JSONDecodeError, KeyError):
+            return set()
+
+    def is_on(self, system_id: int) -> bool:
+        return system_id in self._program_on
+
+    def set(self, system_id: int, on: bool):
+        if on == self.is_on(system_id):
+            return
+        if on:
+            self._program_on.add(system_id)
+        else:
+            self._program_on.discard(system_id)
+        if self._pending is None:
+            self._pending = asyncio.get_running_loop().call_later(
+                self.delay, self._start_flush
+            )
+
+    def _start_flush(self):
+        self._flush_task = asyncio.get_running_loop().create_task(self.flush())
+
+    def _write(self, data: dict):
+        tmp = self.path.with_suffix(".json.tmp")
+        with open(tmp, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+
+    async def flush(self):
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            data = {"program_on": sorted(self._program_on)}
+            try:
+                await asyncio.get_running_loop().run_in_executor(
+                    None, self._write, data
+                )
+            except OSError as e:
+                logger.error(f"Could not save program state: {e}")
+
+    async def close(self):
+        """Waits for a delayed write in progress, then writes any change still
+        pending"""
+        if self._flush_task is not None:
+            await self._flush_task
+            self._flush_task = None
+        await self.flush()
+
+
+program_state = ProgramState()
@@ -0,0 +1,46 @@
+import asyncio
+import time
+from typing import Awaitable, Callable, Optional
+
+
+class CachedReading:
+    """Holds the latest sensor reading and shares one in-flight fetch
+    between all callers that ask for a fresh value at the same time"""
+
+    def __init__(self, fetch: Callable[[], Awaitable[dict]], ttl: float):
+        self._fetch = fetch
+        self.ttl = ttl
+        self.value: Optional[dict] = None
+        self.fetched_at: Optional[float] = None
+        self._in_flight: Optional[asyncio.Future] = None
+
+    @property
+    def age(self) -> Optional[float]:
+        if self.fetched_at is None:
+            return None
+        return time.monotonic() - self.fetched_at
+
+    def is_fresh(self, max_age: Optional[float] = None) -> bool:
+        max_age = self.ttl if max_age is None else max_age
+        age = self.age
+        return age is not None and age <= max_age
+
+    async def get(self, max_age: Optional[float] = None) -> dict:
+        if self.is_fresh(max_age):
+            return self.value
+        if self._in_flight is None:
+            self._in_flight = asyncio.ensure_future(self._refresh())
+        # shield so one cancelled caller doesn't cancel the fetch for the others
+        return await asyncio.shield(self._in_flight)
+
+    async def _refresh(self) -> dict:
+        try:
+            value = await self._fetch()
+            self.value = value
+            self.fetched_at = time.monotonic()
+            return value
+        finally:
+            self._in_flight = None
+
+    def invalidate(self):
+        self.fetched_at = None
@@ -0,0 +1,350 @@
+import calendar
+from bisect import bisect_left, bisect_right, insort
+from datetime import datetime
+from typing import Dict, Iterable, List, NamedTuple, Optional, Set, Tuple
+
+from api_v2.metrics import Gauge
+from api_v2.utils import BritishTime
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+WEEKDAYS = [day.lower() for day in calendar.day_name]
+
+
+def to_minutes(hh_mm: str) -> int:
+    hours, minutes = hh_mm.split(":")
+    return int(hours) * 60 + int(minutes)
+
+
+def minute_of_week(dt: Optional[datetime] = None) -> float:
+    dt = dt if dt is not None else BritishTime.now()
+    return (
+        dt.weekday() * MINUTES_PER_DAY
+        + dt.hour * 60
+        + dt.minute
+        + (dt.second + dt.microsecond / 1e6) / 60
+    )
+
+
+class ScheduledPeriod(NamedTuple):
+    period_id: int
+    time_on: str
+    time_off: str
+    target: int
+    days: dict
+    heating_system_id: int
+    all_systems: bool = False
+
+    @classmethod
+    def from_model(cls, period) -> "ScheduledPeriod":
+        """Accepts a HeatingPeriod ORM object or one of its pydantic models"""
+        system_id = getattr(period, "heating_system_id", None)
+        if system_id is None:
+            system_id = period.heating_system.system_id
+        days = period.days
+        if not isinstance(days, dict):
+            # rows hold only the days that were sent, and a missing day is off;
+            # Days would fill those in as on
+            days = days.dict(exclude_unset=True)
+        return cls(
+            period_id=period.period_id,
+            time_on=period.time_on,
+            time_off=period.time_off,
+            target=period.target,
+            days=days,
+            heating_system_id=system_id,
+            all_systems=bool(getattr(period, "all_systems", False)),
+        )
+
+    def intervals(self) -> Iterable[Tuple[int, int]]:
+        on, off = to_minutes(self.time_on), to_minutes(self.time_off)
+        for i, day in enumerate(WEEKDAYS):
+            if self.days.get(day):
+                yield i * MINUTES_PER_DAY + on, i * MINUTES_PER_DAY + off
+
+
+class WeeklySchedule:
+    """Minute-of-week interval index of the periods that apply to one system"""
+
+    def __init__(
+        self,
+        system_id: int,
+        household_id: int,
+        periods: Iterable[ScheduledPeriod] = (),
+    ):
+        self.system_id = system_id
+        self.household_id = household_id
+        self._periods: Dict[int, ScheduledPeriod] = {}
+        intervals = []
+        for period in periods:
+            if self.applies_to(period):
+                self._periods[period.period_id] = period
+                intervals.extend(
+                    (start, end, period.period_id) for start, end in period.intervals()
+                )
+        intervals.sort()
+        self._intervals: List[Tuple[int, int, int]] = intervals
+        self._starts = [start for start, _, _ in intervals]
+        # running maximum of end times lets current() stop scanning early
+        self._max_ends: List[int] = []
+        max_end = -1
+        for _, end, _ in intervals:
+            max_end = max(max_end, end)
+            self._max_ends.append(max_end)
+        # how many intervals start or end at each minute
+        self._edges: Dict[int, int] = {}
+        for start, end, _ in intervals:
+            self._edges[start] = self._edges.get(start, 0) + 1
+            self._edges[end] = self._edges.get(end, 0) + 1
+        self._boundaries = sorted(self._edges)
+
+    def applies_to(self, period: ScheduledPeriod) -> bool:
+        return period.all_systems or period.heating_system_id == self.system_id
+
+    def _add_edge(self, minute: int):
+        if minute not in self._edges:
+            self._edges[minute] = 0
+            insort(self._boundaries, minute)
+        self._edges[minute] += 1
+
+    def _remove_edge(self, minute: int):
+        self._edges[minute] -= 1
+        if not self._edges[minute]:
+            del self._edges[minute]
+            del self._boundaries[bisect_left(self._boundaries, minute)]
+
+    def _insert(self, interval: Tuple[int, int, int]):
+        i = bisect_left(self._intervals, interval)
+        start, end, _ = interval
+        self._intervals.insert(i, interval)
+        self._starts.insert(i, start)
+        self._max_ends.insert(i, max(self._max_ends[i - 1], end) if i else end)
+        # later running maxima only change until one already exceeds `end`
+        for j in range(i + 1, len(self._max_ends)):
+            if self._max_ends[j] >= end:
+                break
+            self._max_ends[j] = end
+        self._add_edge(start)
+        self._add_edge(end)
+
+    def _delete(self, interval: Tuple[int, int, int]):
+        i = bisect_left(self._intervals, interval)
+        start, end, _ = interval
+        del self._intervals[i], self._starts[i], self._max_ends[i]
+        # recompute the running maxima after it until they agree again
+        max_end = self._max_ends[i - 1] if i else -1
+        for j in range(i, len(self._max_ends)):
+            max_end = max(max_end, self._intervals[j][1])
+            if self._max_ends[j] == max_end:
+                break
+            self._max_ends[j] = max_end
+        self._remove_edge(start)
+        self._remove_edge(end)
+
+    def add(self, period: ScheduledPeriod):
+        """Replaces the period in place, in O(log n) plus the entries moved"""
+        self.remove(period.period_id)
+        if not self.applies_to(period):
+            return
+        self._periods[period.period_id] = period
+        for start, end in period.intervals():
+            self._insert((start, end, period.period_id))
+
+    def remove(self, period_id: int):
+        period = self._periods.pop(period_id, None)
+        if period is not None:
+            for start, end in period.intervals():
+                self._delete((start, end, period_id))
+
+    def __len__(self):
+        return len(self._periods)
+
+    def current(self, minute: Optional[float] = None) -> Optional[ScheduledPeriod]:
+        """The earliest-starting period in force at `minute` (default now)"""
+        minute = minute_of_week() if minute is None else minute
+        found = None
+        i = bisect_left(self._starts, minute) - 1
+        while i >= 0 and self._max_ends[i] > minute:
+            start, end, period_id = self._intervals[i]
+            if start < minute < end:
+                found = period_id
+            i -= 1
+        return self._periods[found] if found is not None else None
+
+    def overlapping(self, start: int, end: int) -> Set[int]:
+        """Ids of the periods with an interval overlapping [start, end)"""
+        found = set()
+        i = bisect_left(self._starts, end) - 1
+        while i >= 0 and self._max_ends[i] > start:
+            _, interval_end, period_id = self._intervals[i]
+            if interval_end > start:
+                found.add(period_id)
+            i -= 1
+        return found
+
+    def next_period(
+        self, minute: Optional[float] = None
+    ) -> Optional[Tuple[ScheduledPeriod, float]]:
+        """The next period to start after `minute` and the minutes until it does"""
+        if not self._intervals:
+            return None
+        minute = minute_of_week() if minute is None else minute
+        i = bisect_right(self._starts, minute)
+        if i < len(self._intervals):
+            start, _, period_id = self._intervals[i]
+            return self._periods[period_id], start - minute
+        start, _, period_id = self._intervals[0]
+        return self._periods[period_id], start + MINUTES_PER_WEEK - minute
+
+    def minutes_to_next_boundary(
+        self, minute: Optional[float] = None
+    ) -> Optional[float]:
+        """Minutes until the next period starts or ends, wrapping over the week"""
+        if not self._boundaries:
+            return None
+        minute = minute_of_week() if minute is None else minute
+        i = bisect_right(self._boundaries, minute)
+        if i < len(self._boundaries):
+            return self._boundaries[i] - minute
+        return self._boundaries[0] + MINUTES_PER_WEEK - minute
+
+
+class HouseholdPeriods:
+    """Every period of one household for overlap checks, indexed by the
+    system it is on with all_systems periods under None. A period clashes
+    with its own system's periods and the all_systems ones; an all_systems
+    period clashes with any."""
+
+    def __init__(self, household_id: int, periods: Iterable[ScheduledPeriod] = ()):
+        self.household_id = household_id
+        self._keys: Dict[int, Optional[int]] = {}
+        by_key: Dict[Optional[int], List[ScheduledPeriod]] = {}
+        for period in periods:
+            self._keys[period.period_id] = self._key(period)
+            by_key.setdefault(self._key(period), []).append(period)
+        self._by_system: Dict[Optional[int], WeeklySchedule] = {
+            key: WeeklySchedule(key, household_id, periods)
+            for key, periods in by_key.items()
+        }
+
+    @staticmethod
+    def _key(period: ScheduledPeriod) -> Optional[int]:
+        return None if period.all_systems else period.heating_system_id
+
+    def get(self, period_id: int) -> Optional[ScheduledPeriod]:
+        if period_id not in self._keys:
+            return None
+        return self._by_system[self._keys[period_id]]._periods[period_id]
+
+    def periods(self) -> List[ScheduledPeriod]:
+        return [
+            period
+            for schedule in self._by_system.values()
+            for period in schedule._periods.values()
+        ]
+
+    def add(self, period: ScheduledPeriod):
+        self.remove(period.period_id)
+        key = self._key(period)
+        schedule = self._by_system.get(key)
+        if schedule is None:
+            schedule = self._by_system[key] = WeeklySchedule(key, self.household_id)
+        schedule.add(period)
+        self._keys[period.period_id] = key
+
+    def remove(self, period_id: int):
+        if period_id in self._keys:
+            self._by_system[self._keys.pop(period_id)].remove(period_id)
+
+    def conflicts(self, period: ScheduledPeriod) -> Set[int]:
+        """Ids of the other periods that overlap `period` where it applies"""
+        if period.all_systems:
+            schedules = list(self._by_system.values())
+        else:
+            schedules = [
+                self._by_system[key]
+                for key in (period.heating_system_id, None)
+                if key in self._by_system
+            ]
+        found = set()
+        for start, end in period.intervals():
+            for schedule in schedules:
+                found |= schedule.overlapping(start, end)
+        found.discard(period.period_id)
+        return found
+
+
+def find_conflicts(
+    index: HouseholdPeriods, changed: List[ScheduledPeriod], replaced: Set[int]
+) -> List[Tuple[int, int]]:
+    """Pairs of overlapping period ids involving a changed period, checked
+    against the indexed periods other than those in `replaced` (updated or
+    deleted) and against each other, so overlaps already stored can't block
+    unrelated edits"""
+    among = HouseholdPeriods(index.household_id, changed)
+    conflicts = set()
+    for period in changed:
+        others = (index.conflicts(period) - replaced) | among.conflicts(period)
+        for other in others:
+            pair = (period.period_id, other)
+            conflicts.add((min(pair), max(pair)))
+    return sorted(conflicts)
+
+
+class ScheduleStore:
+    """Compiled schedules for every running system, kept in step with the
+    heating_period table by manage_times so control ticks never query it"""
+
+    def __init__(self):
+        self._schedules: Dict[int, WeeklySchedule] = {}
+        self._households: Dict[int, HouseholdPeriods] = {}
+        # bumped by every change, so a compile that awaited the database can
+        # tell whether a change it could not apply happened meanwhile
+        self.generation = 0
+
+    def get(self, system_id: int) -> Optional[WeeklySchedule]:
+        return self._schedules.get(system_id)
+
+    def set(self, schedule: WeeklySchedule):
+        self._schedules[schedule.system_id] = schedule
+
+    def get_household(self, household_id: int) -> Optional[HouseholdPeriods]:
+        return self._households.get(household_id)
+
+    def set_household(self, periods: HouseholdPeriods):
+        self._households[periods.household_id] = periods
+
+    def _household(self, household_id: int) -> Iterable[WeeklySchedule]:
+        return [s for s in self._schedules.values() if s.household_id == household_id]
+
+    def add_period(self, household_id: int, period: ScheduledPeriod):
+        self.generation += 1
+        if household_id in self._households:
+            self._households[household_id].add(period)
+        for schedule in self._household(household_id):
+            if schedule.applies_to(period):
+                schedule.add(period)
+            else:
+                schedule.remove(period.period_id)
+
+    def remove_period(self, household_id: int, period_id: int):
+        self.generation += 1
+        if household_id in self._households:
+            self._households[household_id].remove(period_id)
+        for schedule in self._household(household_id):
+            schedule.remove(period_id)
+
+    def invalidate(self, system_id: Optional[int] = None):
+        self.generation += 1
+        if system_id is None:
+            self._schedules.clear()
+            self._households.clear()
+        else:
+            self._schedules.pop(system_id, None)
+
+
+schedules = ScheduleStore()
+
+Gauge("heating_schedules", "Compiled weekly schedules held in memory").set_function(
+    lambda: len(schedules._schedules)
+)
@@ -0,0 +1,124 @@
+import math
+import weakref
+from array import array
+from typing import List, Optional
+
+from ..metrics import Gauge
+
+NAN = float("nan")
+FIELDS = ("temperature", "humidity", "pressure", "target")
+
+_buffers = weakref.WeakSet()
+
+
+class TelemetryBuffer:
+    """Fixed-size ring buffer of one system's readings, one typed array per
+    column so memory stays constant (about 25 bytes per sample)"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self._head = 0
+        self._size = 0
+        self.timestamps = array("d", [0.0]) * capacity
+        self.columns = {field: array("f", [NAN]) * capacity for field in FIELDS}
+        self.relay = array("b", [0]) * capacity
+        _buffers.add(self)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def nbytes(self) -> int:
+        columns = (self.timestamps, self.relay, *self.columns.values())
+        return sum(column.itemsize * len(column) for column in columns)
+
+    @staticmethod
+    def _float(value) -> float:
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return NAN
+
+    def append(
+        self,
+        timestamp: float,
+        measurements: Optional[dict],
+        relay_on: bool,
+        target: Optional[float],
+    ):
+        i = self._head
+        measurements = measurements or {}
+        self.timestamps[i] = timestamp
+        for field in FIELDS[:-1]:
+            self.columns[field][i] = self._float(measurements.get(field))
+        self.columns["target"][i] = self._float(target)
+        self.relay[i] = 1 if relay_on else 0
+        self._head = (i + 1) % self.capacity
+        self._size = min(self._size + 1, self.capacity)
+
+    def _indices(self):
+        """Buffer positions in chronological order"""
+        start = (self._head - self._size) % self.capacity
+        for n in range(self._size):
+            yield (start + n) % self.capacity
+
+    @property
+    def oldest(self) -> Optional[float]:
+        if not self._size:
+            return None
+        return self.timestamps[(self._head - self._size) % self.capacity]
+
+    def downsample(self, since: float, until: float, buckets: int) -> List[dict]:
+        """Min, max and mean of every column over `buckets` equal windows"""
+        width = (until - since) / buckets
+        counts = [0] * buckets
+        relay = [0] * buckets
+        sums = {field: [0.0] * buckets for field in FIELDS}
+        valid = {field: [0] * buckets for field in FIELDS}
+        mins = {field: [math.inf] * buckets for field in FIELDS}
+        maxs = {field: [-math.inf] * buckets for field in FIELDS}
+        for i in self._indices():
+            t = self.timestamps[i]
+            if t < since or t >= until:
+                continue
+            b = int((t - since) / width)
+            counts[b] += 1
+            relay[b] += self.relay[i]
+            for field in FIELDS:
+                value = self.columns[field][i]
+                if value != value:  # NaN
+                    continue
+                sums[field][b] += value
+                valid[field][b] += 1
+                if value < mins[field][b]:
+                    mins[field][b] = value
+                if value > maxs[field][b]:
+                    maxs[field][b] = value
+        result = []
+        for b in range(buckets):
+            if not counts[b]:
+                continue
+            bucket = {
+                "start": since + b * width,
+                "end": since + (b + 1) * width,
+                "samples": counts[b],
+                "relay_on": relay[b] / counts[b],
+            }
+            for field in FIELDS:
+                n = valid[field][b]
+                bucket[field] = (
+                    {
+                        "min": mins[field][b],
+                        "max": maxs[field][b],
+                        "mean": sums[field][b] / n,
+                    }
+                    if n
+                    else None
+                )
+            result.append(bucket)
+        return result
+
+
+Gauge(
+    "heating_telemetry_buffer_bytes", "Memory held by in-memory telemetry buffers"
+).set_function(lambda: sum(buffer.nbytes for buffer in list(_buffers)))
@@ -0,0 +1,318 @@
+import asyncio
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+from ..logger import get_logger
+from ..metrics import Gauge
+from api_v2.settings import (
+    GLOBAL_LOG_LEVEL,
+    TELEMETRY_DB_PATH,
+    TELEMETRY_FLUSH_INTERVAL,
+    TELEMETRY_BATCH_SIZE,
+    TELEMETRY_MAX_PENDING,
+    TELEMETRY_ROLLUP_INTERVAL,
+    TELEMETRY_RETENTION,
+)
+
+logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
+
+RAW = 0
+ROLLUP_RESOLUTIONS = (300, 3600, 86400)
+# longest range (seconds) each resolution is used for when querying
+QUERY_RESOLUTIONS = ((6 * 3600, RAW), (7 * 86400, 300), (90 * 86400, 3600))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reading (
+    system_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    temperature REAL,
+    humidity REAL,
+    pressure REAL,
+    relay_on INTEGER NOT NULL,
+    target REAL
+);
+CREATE INDEX IF NOT EXISTS reading_system_ts ON reading (system_id, ts);
+-- rollups and retention filter on ts alone
+CREATE INDEX IF NOT EXISTS reading_ts ON reading (ts);
+CREATE TABLE IF NOT EXISTS relay_transition (
+    system_id INTEGER NOT NULL,
+    ts REAL NOT NULL,
+    relay_on INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS relay_transition_system_ts
+    ON relay_transition (system_id, ts);
+CREATE INDEX IF NOT EXISTS relay_transition_ts ON relay_transition (ts);
+CREATE TABLE IF NOT EXISTS rollup (
+    system_id INTEGER NOT NULL,
+    resolution INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    samples INTEGER NOT NULL,
+    temperature_min REAL,
+    temperature_max REAL,
+    temperature_mean REAL,
+    humidity_mean REAL,
+    pressure_mean REAL,
+    relay_on REAL,
+    target_mean REAL,
+    PRIMARY KEY (system_id, resolution, bucket)
+) WITHOUT ROWID;
+"""
+
+# without ANALYZE stats the planner prefers walking reading_system_ts for the
+# GROUP BY, which reads the whole table; only the recent tail is wanted
+ROLLUP_SQL = """
+INSERT OR REPLACE INTO rollup
+SELECT system_id, :resolution, CAST(ts / :resolution AS INTEGER) * :resolution,
+       COUNT(*), MIN(temperature), MAX(temperature), AVG(temperature),
+       AVG(humidity), AVG(pressure), AVG(relay_on), AVG(target)
+FROM reading INDEXED BY reading_ts
+WHERE ts >= :since
+GROUP BY system_id, CAST(ts / :resolution AS INTEGER)
+"""
+
+# the same aggregation for one system, for readings not rolled up yet
+AGGREGATE_SQL = """
+SELECT CAST(ts / :resolution AS INTEGER) * :resolution AS ts, COUNT(*) AS samples,
+       MIN(temperature) AS temperature_min, MAX(temperature) AS temperature_max,
+       AVG(temperature) AS temperature_mean, AVG(humidity) AS humidity_mean,
+       AVG(pressure) AS pressure_mean, AVG(relay_on) AS relay_on,
+       AVG(target) AS target_mean
+FROM reading
+WHERE system_id = :system_id AND ts >= :since AND ts < :until
+GROUP BY CAST(ts / :resolution AS INTEGER)
+ORDER BY 1
+"""
+
+
+def query_resolution(since: float, until: float, now: float) -> int:
+    """The coarsest resolution that suits the span, or a coarser one when
+    `since` is older than that resolution is kept for"""
+    preferred = ROLLUP_RESOLUTIONS[-1]
+    for max_span, candidate in QUERY_RESOLUTIONS:
+        if until - since <= max_span:
+            preferred = candidate
+            break
+    for resolution in (RAW,) + ROLLUP_RESOLUTIONS:
+        keep = TELEMETRY_RETENTION.get(resolution)
+        if resolution >= preferred and (keep is None or since >= now - keep):
+            return resolution
+    return ROLLUP_RESOLUTIONS[-1]
+
+
+class TelemetryStore:
+    """Write-behind store for readings and relay transitions in a dedicated
+    SQLite file, so telemetry never contends with the API's database.
+    Records are buffered in memory and written in batches on a single
+    worker thread, which also maintains rollups and prunes old rows."""
+
+    def __init__(self, path: str = TELEMETRY_DB_PATH):
+        self.path = path
+        self._readings = deque(maxlen=TELEMETRY_MAX_PENDING)
+        self._transitions: List[Tuple] = []
+        self._dropped = 0
+        self._rolled_up_to: Optional[float] = None
+        self._executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="telemetry"
+        )
+        self._connection: Optional[sqlite3.Connection] = None
+        self._flush_now: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def record(
+        self,
+        system_id: int,
+        timestamp: float,
+        measurements: Optional[dict],
+        relay_on: bool,
+        target: Optional[float],
+    ):
+        if len(self._readings) == self._readings.maxlen:
+            self._dropped += 1
+        measurements = measurements or {}
+        self._readings.append(
+            (
+                system_id,
+                timestamp,
+                measurements.get("temperature"),
+                measurements.get("humidity"),
+                measurements.get("pressure"),
+                1 if relay_on else 0,
+                target,
+            )
+        )
+        if len(self._readings) >= TELEMETRY_BATCH_SIZE and self._flush_now:
+            self._flush_now.set()
+
+    def record_transition(self, system_id: int, timestamp: float, relay_on: bool):
+        self._transitions.append((system_id, timestamp, 1 if relay_on else 0))
+
+    def _connect(self) -> sqlite3.Connection:
+        if self._connection is None:
+            self._connection = sqlite3.connect(self.path)
+            self._connection.execute("PRAGMA journal_mode=WAL")
+            self._connection.execute("PRAGMA synchronous=NORMAL")
+            self._connection.executescript(SCHEMA)
+        return self._connection
+
+    def _write(self, readings: List[Tuple], transitions: List[Tuple]):
+        with self._connect() as db:
+            db.executemany(
+                "INSERT INTO reading VALUES (?, ?, ?, ?, ?, ?, ?)", readings
+            )
+            db.executemany(
+                "INSERT INTO relay_transition VALUES (?, ?, ?)", transitions
+            )
+
+    def _rollup_and_prune(self, now: float):
+        since = self._rolled_up_to
+        with self._connect() as db:
+            if since is None:
+                since = db.execute(
+                    "SELECT COALESCE(MAX(bucket), 0) FROM rollup "
+                    "WHERE resolution = ?",
+                    (ROLLUP_RESOLUTIONS[0],),
+                ).fetchone()[0]
+            for resolution in ROLLUP_RESOLUTIONS:
+                # recompute the (possibly partial) bucket the last run ended in
+                start = (since // resolution) * resolution
+                db.execute(ROLLUP_SQL, {"resolution": resolution, "since": start})
+            for resolution, keep in TELEMETRY_RETENTION.items():
+                if keep is None:
+                    continue
+                if resolution == RAW:
+                    db.execute("DELETE FROM reading WHERE ts < ?", (now - keep,))
+                    db.execute(
+                        "DELETE FROM relay_transition WHERE ts < ?", (now - keep,)
+                    )
+                else:
+                    db.execute(
+                        "DELETE FROM rollup WHERE resolution = ? AND bucket < ?",
+                        (resolution, now - keep),
+                    )
+        self._rolled_up_to = now
+
+    def _query(self, system_id: int, since: float, until: float, resolution: int):
+        db = self._connect()
+        db.row_factory = sqlite3.Row
+        try:
+            if resolution == RAW:
+                rows = db.execute(
+                    "SELECT ts, 1 AS samples, temperature AS temperature_min, "
+                    "temperature AS temperature_max, "
+                    "temperature AS temperature_mean, humidity AS humidity_mean, "
+                    "pressure AS pressure_mean, relay_on, target AS target_mean "
+                    "FROM reading "
+                    "WHERE system_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+                    (system_id, since, until),
+                )
+                return [dict(row) for row in rows]
+            # the newest rollup bucket may be partial and later readings
+            # aren't rolled up yet, so that tail is aggregated from raw rows
+            rolled_up_to = db.execute(
+                "SELECT MAX(bucket) FROM rollup WHERE system_id = ? AND resolution = ?",
+                (system_id, resolution),
+            ).fetchone()[0]
+            rolled_up_to = since if rolled_up_to is None else rolled_up_to
+            rows = db.execute(
+                "SELECT bucket AS ts, samples, temperature_min, "
+                "temperature_max, temperature_mean, humidity_mean, "
+                "pressure_mean, relay_on, target_mean FROM rollup "
+                "WHERE system_id = ? AND resolution = ? "
+                "AND bucket >= ? AND bucket < ? ORDER BY bucket",
+                (system_id, resolution, since, min(until, rolled_up_to)),
+            ).fetchall()
+            tail = db.execute(
+                AGGREGATE_SQL,
+                {
+                    "resolution": resolution,
+                    "system_id": system_id,
+                    "since": max(since, rolled_up_to),
+                    "until": until,
+                },
+            ).fetchall()
+            return [dict(row) for row in rows + tail]
+        finally:
+            db.row_factory = None
+
+    def _transitions_between(self, system_id: int, since: float, until: float):
+        return self._connect().execute(
+            "SELECT ts, relay_on FROM relay_transition "
+            "WHERE system_id = ? AND ts >= ? AND ts < ? ORDER BY ts",
+            (system_id, since, until),
+        ).fetchall()
+
+    async def _run(self, func, *args):
+        return await asyncio.get_running_loop().run_in_executor(
+            self._executor, func, *args
+        )
+
+    async def flush(self):
+        readings = list(self._readings)
+        self._readings.clear()
+        transitions, self._transitions = self._transitions, []
+        if not (readings or transitions):
+            return
+        try:
+            await self._run(self._write, readings, transitions)
+        except sqlite3.Error as e:
+            logger.error(f"Telemetry write of {len(readings)} readings failed: {e}")
+        if self._dropped:
+            logger.warning(f"Telemetry queue full, dropped {self._dropped} readings")
+            self._dropped = 0
+
+    async def rollup(self):
+        try:
+            await self._run(self._rollup_and_prune, time.time())
+        except sqlite3.Error as e:
+            logger.error(f"Telemetry rollup failed: {e}")
+
+    async def query(
+        self, system_id: int, since: float, until: float
+    ) -> Tuple[int, List[dict], List[Tuple[float, int]]]:
+        """Readings at the coarsest resolution that still suits the range and
+        is still kept for it, plus every relay transition in it"""
+        resolution = query_resolution(since, until, time.time())
+        await self.flush()
+        rows = await self._run(self._query, system_id, since, until, resolution)
+        transitions = await self._run(
+            self._transitions_between, system_id, since, until
+        )
+        return resolution, rows, transitions
+
+    async def _maintain(self):
+        last_rollup = 0.0
+        while True:
+            try:
+                await asyncio.wait_for(self._flush_now.wait(), TELEMETRY_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._flush_now.clear()
+            await self.flush()
+            if time.monotonic() - last_rollup >= TELEMETRY_ROLLUP_INTERVAL:
+                await self.rollup()
+                last_rollup = time.monotonic()
+
+    def start(self):
+        if self._task is None or self._task.done():
+            self._flush_now = asyncio.Event()
+            self._task = asyncio.get_running_loop().create_task(self._maintain())
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        await self.rollup()
+        if self._connection is not None:
+            await self._run(self._connection.close)
+            self._connection = None
+
+
+telemetry_store = TelemetryStore()
+
+Gauge(
+    "telemetry_pending_readings", "Readings waiting to be written to SQLite"
+).set_function(lambda: len(telemetry_store._readings))
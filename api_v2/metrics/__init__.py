@@ -0,0 +1,6 @@
+from .registry import Counter, Gauge, Histogram, Registry, default_registry
+from .http import MetricsMiddleware, current_route
+from .orm import instrument_tortoise
+from .timing import ServerTimingMiddleware, TimedRoute, record_phase, timed_phase
+from .profiler import ProfilerBusy, profiler
+from .memory import memory_tracker, object_counts
@@ -0,0 +1,65 @@
+import time
+from contextvars import ContextVar
+
+from .registry import Counter, Histogram
+
+UNMATCHED = "unmatched"
+
+# route template of the request being served, for labelling work done on
+# its behalf (ORM queries); anything outside a request is "background"
+current_route: ContextVar[str] = ContextVar("current_route", default="background")
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "http_request_duration_seconds",
+    "Time to serve an HTTP request",
+    ("method", "route"),
+)
+HTTP_REQUESTS = Counter(
+    "http_requests",
+    "HTTP requests served, by response status",
+    ("method", "route", "status"),
+)
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware timing every HTTP request by route. Routes are
+    labelled by their path when it is one the app declares, so unknown
+    paths can't grow the number of series."""
+
+    def __init__(self, app):
+        self.app = app
+        self._routes = None
+
+    def route_label(self, scope) -> str:
+        if self._routes is None:
+            routes = getattr(scope.get("app"), "routes", None)
+            if routes is None:
+                return UNMATCHED
+            self._routes = {r.path for r in routes if hasattr(r, "path")}
+        path = scope["path"]
+        return path if path in self._routes else UNMATCHED
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        route = self.route_label(scope)
+        token = current_route.set(route)
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            method = scope["method"]
+            HTTP_REQUEST_SECONDS.labels(method, route).observe(
+                time.perf_counter() - started
+            )
+            HTTP_REQUESTS.labels(method, route, status).inc()
+            current_route.reset(token)
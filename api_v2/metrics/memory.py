@@ -0,0 +1,204 @@
+import asyncio
+import gc
+import logging
+import resource
+import time
+import tracemalloc
+from collections import Counter as TypeCounter
+from pathlib import Path
+from typing import Optional
+
+from ..logger import get_logger
+from ..settings import (
+    GLOBAL_LOG_LEVEL,
+    MEMORY_CHECK_INTERVAL,
+    MEMORY_DUMP_DIR,
+    MEMORY_DUMP_THRESHOLD_MB,
+    TRACEMALLOC_FRAMES,
+)
+from .registry import Gauge
+
+logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
+
+# objects suspected of leaking across kill_system/create_instance cycles,
+# always reported by object_counts() even when there are none
+WATCHED_TYPES = (
+    "api_v2.heating.heating_system.HeatingSystem",
+    "api_v2.heating.gpio_state.GPIOHost",
+    "pigpio.pi",
+    "aiohttp.client.ClientSession",
+    "aiohttp.connector.TCPConnector",
+    "_asyncio.Task",
+)
+
+
+def rss_bytes() -> int:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def logging_handlers() -> int:
+    loggers = [logging.getLogger()] + [
+        log
+        for log in logging.Logger.manager.loggerDict.values()
+        if isinstance(log, logging.Logger)
+    ]
+    return sum(len(log.handlers) for log in loggers)
+
+
+def _type_name(cls) -> str:
+    return f"{cls.__module__}.{cls.__qualname__}"
+
+
+def object_counts(limit: int = 30) -> dict:
+    """Live gc-tracked objects by type, the `limit` most common first.
+    Walks every object, so it takes a noticeable fraction of a second on
+    a Pi; only call it on demand."""
+    counts = TypeCounter(_type_name(type(obj)) for obj in gc.get_objects())
+    return {
+        "total": sum(counts.values()),
+        "watched": {name: counts.get(name, 0) for name in WATCHED_TYPES},
+        "logging_handlers": logging_handlers(),
+        "top": dict(counts.most_common(limit)),
+    }
+
+
+def _stat(stat) -> dict:
+    frame = stat.traceback[0]
+    return {
+        "location": f"{frame.filename}:{frame.lineno}",
+        "size": stat.size,
+        "count": stat.count,
+    }
+
+
+def _diff(stat) -> dict:
+    return {
+        **_stat(stat),
+        "size_diff": stat.size_diff,
+        "count_diff": stat.count_diff,
+    }
+
+
+class MemoryTracker:
+    """On-demand tracemalloc snapshots, each diffed against the previous
+    one, plus a background check that writes a snapshot to disk when the
+    resident set grows past MEMORY_DUMP_THRESHOLD_MB"""
+
+    def __init__(self):
+        self._previous: Optional[tracemalloc.Snapshot] = None
+        self._previous_at: Optional[float] = None
+        self._over_threshold = False
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def tracing(self) -> bool:
+        return tracemalloc.is_tracing()
+
+    def start_tracing(self, frames: int = TRACEMALLOC_FRAMES):
+        if not tracemalloc.is_tracing():
+            logger.info(f"Starting tracemalloc ({frames} frames)")
+            tracemalloc.start(frames)
+
+    def stop_tracing(self):
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+            logger.info("Stopped tracemalloc")
+        self._previous = self._previous_at = None
+
+    def status(self) -> dict:
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            "rss_bytes": rss_bytes(),
+            "tracing": self.tracing,
+            "traced_bytes": traced,
+            "traced_peak_bytes": peak,
+            "tracemalloc_overhead_bytes": tracemalloc.get_tracemalloc_memory(),
+            "gc_counts": gc.get_count(),
+            "logging_handlers": logging_handlers(),
+            "threshold_mb": MEMORY_DUMP_THRESHOLD_MB,
+        }
+
+    def _take_snapshot(self) -> tracemalloc.Snapshot:
+        if not self.tracing:
+            raise RuntimeError("tracemalloc is not running")
+        return tracemalloc.take_snapshot().filter_traces(
+            (tracemalloc.Filter(False, tracemalloc.__file__),)
+        )
+
+    def snapshot(self, limit: int = 25, key_type: str = "lineno") -> dict:
+        """Largest allocation sites now, and the biggest changes since the
+        previous call"""
+        current = self._take_snapshot()
+        now = time.time()
+        result = {
+            "taken_at": now,
+            "top": [_stat(s) for s in current.statistics(key_type)[:limit]],
+            "previous_at": self._previous_at,
+            "diff": None,
+        }
+        if self._previous is not None:
+            result["diff"] = [
+                _diff(s) for s in current.compare_to(self._previous, key_type)[:limit]
+            ]
+        self._previous, self._previous_at = current, now
+        return result
+
+    def dump(self, reason: str = "manual") -> Path:
+        """Writes a snapshot for later analysis with tracemalloc.Snapshot.load"""
+        directory = Path(MEMORY_DUMP_DIR)
+        directory.mkdir(parents=True, exist_ok=True)
+        path = directory / f"{time.strftime('%Y%m%d-%H%M%S')}-{reason}.tracemalloc"
+        self._take_snapshot().dump(str(path))
+        logger.warning(f"Wrote memory snapshot to {path}")
+        return path
+
+    def check_threshold(self):
+        if MEMORY_DUMP_THRESHOLD_MB is None:
+            return
+        over = rss_bytes() > MEMORY_DUMP_THRESHOLD_MB * 1024 * 1024
+        if over and not self._over_threshold:
+            logger.warning(f"Resident memory above {MEMORY_DUMP_THRESHOLD_MB} MB")
+            try:
+                self.dump("threshold")
+            except (OSError, RuntimeError) as e:
+                logger.error(f"Memory snapshot failed: {e}")
+        self._over_threshold = over
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(MEMORY_CHECK_INTERVAL)
+            self.check_threshold()
+
+    def start(self):
+        """Starts tracing and the threshold check when a threshold is set"""
+        if MEMORY_DUMP_THRESHOLD_MB is None:
+            return
+        self.start_tracing()
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._watch())
+
+    def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+
+memory_tracker = MemoryTracker()
+
+Gauge(
+    "process_resident_memory_bytes", "Resident memory of this process"
+).set_function(rss_bytes)
+Gauge(
+    "python_tracemalloc_traced_bytes",
+    "Memory traced by tracemalloc (0 while it is off)",
+).set_function(lambda: tracemalloc.get_traced_memory()[0])
+Gauge(
+    "python_logging_handlers", "Handlers attached to all loggers"
+).set_function(logging_handlers)
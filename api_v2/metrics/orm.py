@@ -0,0 +1,50 @@
+import functools
+import time
+
+from tortoise import connections
+
+from .http import current_route
+from .registry import Histogram
+from .timing import record_phase
+
+DB_METHODS = (
+    "execute_insert",
+    "execute_many",
+    "execute_query",
+    "execute_query_dict",
+    "execute_script",
+)
+
+ORM_QUERY_SECONDS = Histogram(
+    "orm_query_duration_seconds",
+    "Time spent in database queries, by the HTTP route that issued them",
+    ("route",),
+)
+
+
+def _timed(method):
+    @functools.wraps(method)
+    async def timed(self, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await method(self, *args, **kwargs)
+        finally:
+            elapsed = time.perf_counter() - started
+            ORM_QUERY_SECONDS.labels(current_route.get()).observe(elapsed)
+            record_phase("db", elapsed)
+
+    timed.timed = True
+    return timed
+
+
+def instrument_tortoise():
+    """Times the execute_* methods of every initialised connection's client
+    class and of its transaction wrapper, so queries inside transactions
+    are counted too. Safe to call more than once."""
+    for connection in connections.all():
+        client_class = type(connection)
+        for cls in (client_class, *client_class.__subclasses__()):
+            for name in DB_METHODS:
+                method = cls.__dict__.get(name)
+                if method is not None and not getattr(method, "timed", False):
+                    setattr(cls, name, _timed(method))
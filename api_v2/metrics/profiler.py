@@ -0,0 +1,77 @@
+import asyncio
+import os
+import sys
+import threading
+from collections import Counter
+from pathlib import Path
+from typing import Dict
+
+ROOT_DIR = str(Path(__file__).parent.parent.parent.absolute())
+
+
+class ProfilerBusy(Exception):
+    pass
+
+
+class SamplingProfiler:
+    """Samples the event loop thread's Python stack from a background thread
+    and counts identical stacks. Every HeatingSystem tick, request handler
+    and background task runs on that thread, so the result covers all of
+    them; time the loop spends idle shows up under the selector. Nothing
+    in the profiled code is instrumented, and only one profile runs at a
+    time."""
+
+    def __init__(self):
+        self._running = False
+        self._names: Dict[str, str] = {}
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def _frame_name(self, code) -> str:
+        filename = code.co_filename
+        name = self._names.get(filename)
+        if name is None:
+            if filename.startswith(ROOT_DIR):
+                name = os.path.relpath(filename, ROOT_DIR)
+            else:
+                name = os.path.basename(filename)
+            self._names[filename] = name
+        return f"{name}:{code.co_name}"
+
+    def _sample(self, thread_id: int, interval: float, stop, counts: Counter):
+        while not stop.wait(interval):
+            frame = sys._current_frames().get(thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(self._frame_name(frame.f_code))
+                frame = frame.f_back
+            counts[";".join(reversed(stack))] += 1
+
+    async def profile(self, seconds: float, interval: float) -> str:
+        """Profiles the calling event loop for `seconds` and returns the
+        samples in collapsed-stack format (one `frame;frame;... count` line
+        per distinct stack), ready for flamegraph.pl or speedscope"""
+        if self._running:
+            raise ProfilerBusy("A profile is already running")
+        self._running = True
+        counts = Counter()
+        stop = threading.Event()
+        sampler = threading.Thread(
+            target=self._sample,
+            args=(threading.get_ident(), interval, stop, counts),
+            name="profiler",
+            daemon=True,
+        )
+        try:
+            sampler.start()
+            await asyncio.sleep(seconds)
+        finally:
+            stop.set()
+            await asyncio.get_running_loop().run_in_executor(None, sampler.join)
+            self._running = False
+        return "".join(f"{stack} {n}\n" for stack, n in counts.most_common())
+
+
+profiler = SamplingProfiler()
@@ -0,0 +1,99 @@
+import asyncio
+import functools
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Optional
+
+from fastapi.routing import APIRoute
+
+_ENDPOINT_DONE = "_endpoint_done"
+
+# phase -> seconds for the request being served; None unless
+# ServerTimingMiddleware is installed, which makes recording a no-op
+_phases: ContextVar[Optional[Dict[str, float]]] = ContextVar(
+    "server_timing", default=None
+)
+
+
+def record_phase(name: str, seconds: float):
+    phases = _phases.get()
+    if phases is not None:
+        phases[name] = phases.get(name, 0.0) + seconds
+
+
+@contextmanager
+def timed_phase(name: str):
+    if _phases.get() is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_phase(name, time.perf_counter() - started)
+
+
+class TimedRoute(APIRoute):
+    """Notes when the endpoint returns, so ServerTimingMiddleware can report
+    the time FastAPI then spends validating and serialising the response"""
+
+    def get_route_handler(self):
+        call = self.dependant.call
+        if asyncio.iscoroutinefunction(call):
+
+            @functools.wraps(call)
+            async def endpoint(*args, **kwargs):
+                try:
+                    return await call(*args, **kwargs)
+                finally:
+                    phases = _phases.get()
+                    if phases is not None:
+                        phases[_ENDPOINT_DONE] = time.perf_counter()
+
+            self.dependant.call = endpoint
+        return super().get_route_handler()
+
+
+class ServerTimingMiddleware:
+    """Adds a Server-Timing header to every response, e.g.
+    `auth;dur=2.1, db;dur=4.0, sensor;dur=51.3, serialize;dur=0.8,
+    total;dur=60.2`. Phases add up the time spent in them, so they can
+    overlap: auth includes its user lookup, which is also counted under
+    db, and sensor waits for several systems may run side by side."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        phases = {}
+        token = _phases.set(phases)
+        started = time.perf_counter()
+
+        async def send_with_timing(message):
+            if message["type"] == "http.response.start":
+                now = time.perf_counter()
+                endpoint_done = phases.pop(_ENDPOINT_DONE, None)
+                if endpoint_done is not None:
+                    phases["serialize"] = now - endpoint_done
+                phases["total"] = now - started
+                header = ", ".join(
+                    f"{name};dur={seconds * 1000:.1f}"
+                    for name, seconds in phases.items()
+                )
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"server-timing", header.encode()),
+                    ],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _phases.reset(token)
@@ -23,10 +23,16 @@ from .pydantic_models import (
     PHeatingSystemIn,
     HeatingSystemModelCreator,
     TimesResponse,
+    TimesBatch,
+    TimesBatchResponse,
     HeatingV2Response,
     SystemInfo,
+    SystemErrorInfo,
     ProgramOnlyResponse,
+    HistoryResponse,
+    TelemetryResponse,
 )
+from .database import tune_database
 from .weather import (
     WeatherDay,
     WeatherDaySingle,
@@ -1,8 +1,6 @@
 from tortoise import Model, fields
-from passlib.context import CryptContext
 
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+from ..utils import password_pool
 
 
 class Household(Model):
@@ -16,8 +14,8 @@ class HouseholdMember(Model):
     password_hash = fields.CharField(128)
     household = fields.ForeignKeyField("models.Household", related_name="members")
 
-    def verify_password(self, password):
-        return pwd_context.verify(password, self.password_hash)
+    async def verify_password(self, password):
+        return await password_pool.verify(password, self.password_hash)
 
     class Meta:
         table = "household_member"
@@ -0,0 +1,66 @@
+from typing import Dict, List
+
+from tortoise import Tortoise
+
+from ..logger import get_logger
+from ..settings import (
+    DATABASE_QUERY_PLAN_REPORT,
+    GLOBAL_LOG_LEVEL,
+    SQLITE_PRAGMAS,
+)
+from .authentication import HouseholdMember
+from .heating import HeatingPeriod, HeatingSystemModel
+
+logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
+
+
+def hot_queries() -> Dict[str, str]:
+    """SQL of the queries run on most requests and control ticks, with
+    placeholder values"""
+    return {
+        "member by name": HouseholdMember.filter(name="name").sql(),
+        "household periods": HeatingPeriod.schedule_rows(1).sql(),
+        "household systems": HeatingSystemModel.filter(household_id=1).sql(),
+        "systems in household": HeatingSystemModel.filter(
+            household_id=1, system_id__in=[1, 2]
+        )
+        .values_list("system_id", flat=True)
+        .sql(),
+        "periods in household": HeatingPeriod.filter(
+            household_id=1, period_id__in=[1, 2]
+        ).sql(),
+    }
+
+
+async def check_pragmas() -> Dict[str, str]:
+    """Reads back the pragmas SQLite actually applied; journal_mode falls
+    back silently where WAL isn't supported (e.g. some network filesystems)"""
+    connection = Tortoise.get_connection("default")
+    applied = {}
+    for pragma in SQLITE_PRAGMAS:
+        _, rows = await connection.execute_query(f"PRAGMA {pragma}")
+        applied[pragma] = str(rows[0][0]) if rows else None
+    if applied.get("journal_mode", "").lower() != "wal":
+        logger.warning(f"SQLite is not in WAL mode ({applied.get('journal_mode')})")
+    logger.info(f"SQLite pragmas: {applied}")
+    return applied
+
+
+async def query_plans() -> Dict[str, List[str]]:
+    """EXPLAIN QUERY PLAN of each hot query, warning about full table scans"""
+    connection = Tortoise.get_connection("default")
+    plans = {}
+    for name, sql in hot_queries().items():
+        _, rows = await connection.execute_query(f"EXPLAIN QUERY PLAN {sql}")
+        plans[name] = [row["detail"] for row in rows]
+        for detail in plans[name]:
+            if detail.startswith("SCAN") and "INDEX" not in detail:
+                logger.warning(f"Full table scan in {name}: {detail}")
+        logger.info(f"Query plan for {name}: {'; '.join(plans[name])}")
+    return plans
+
+
+async def tune_database():
+    await check_pragmas()
+    if DATABASE_QUERY_PLAN_REPORT:
+        await query_plans()
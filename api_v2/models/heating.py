@@ -1,15 +1,23 @@
 import re
+from typing import Optional
 
 from tortoise import Model, fields
 from tortoise.exceptions import ValidationError
 from tortoise.validators import RegexValidator
 
+from api_v2.heating.schedule import ScheduledPeriod
 from api_v2.heating.systems_in_memory import systems_in_memory
 
 
+MIN_TARGET, MAX_TARGET = 5, 30
+TIME_PATTERN = "[0-2]?[0-9]:[0-5][0-9]"
+
+
 def target_validator(value: int):
-    if value > 30 or value < 5:
-        raise ValidationError(f"Target must be between 30 and 5 ({value} is not)")
+    if value > MAX_TARGET or value < MIN_TARGET:
+        raise ValidationError(
+            f"Target must be between {MAX_TARGET} and {MIN_TARGET} ({value} is not)"
+        )
 
 
 class HeatingSystemModel(Model):
@@ -38,15 +46,16 @@ class HeatingSystemModel(Model):
 
     class Meta:
         table = "heating_system"
+        indexes = (("household_id", "system_id"),)
 
 
 class HeatingPeriod(Model):
     period_id = fields.IntField(pk=True, auto_increment=True)
     time_on = fields.CharField(
-        5, validators=[RegexValidator("[0-2]?[0-9]:[0-5][0-9]", re.I)]
+        5, validators=[RegexValidator(TIME_PATTERN, re.I)]
     )
     time_off = fields.CharField(
-        5, validators=[RegexValidator("[0-2]?[0-9]:[0-5][0-9]", re.I)]
+        5, validators=[RegexValidator(TIME_PATTERN, re.I)]
     )
     target = fields.IntField(validators=[target_validator])
     days = fields.JSONField()
@@ -66,5 +75,15 @@ class HeatingPeriod(Model):
     )
     all_systems = fields.BooleanField(default=False)
 
+    @classmethod
+    def schedule_rows(cls, household_id: int, exclude_period: Optional[int] = None):
+        """The household's periods as ScheduledPeriod fields, in one query
+        without related objects"""
+        qs = cls.filter(household_id=household_id)
+        if exclude_period is not None:
+            qs = qs.exclude(period_id=exclude_period)
+        return qs.values(*ScheduledPeriod._fields)
+
     class Meta:
         table = "heating_period"
+        indexes = (("household_id", "heating_system_id"), ("heating_system_id",))
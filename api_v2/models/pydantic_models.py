@@ -1,12 +1,18 @@
 from datetime import datetime
 from typing import Optional, List
 
-from pydantic import BaseModel
+from pydantic import BaseModel, Field, constr
 from pydantic.class_validators import root_validator
 from tortoise.contrib.pydantic import pydantic_model_creator
 
 from .authentication import Household, HouseholdMember
-from .heating import HeatingPeriod, HeatingSystemModel
+from .heating import (
+    MAX_TARGET,
+    MIN_TARGET,
+    TIME_PATTERN,
+    HeatingPeriod,
+    HeatingSystemModel,
+)
 
 HouseholdPydantic = pydantic_model_creator(Household, name="Household")
 HouseholdPydanticIn = pydantic_model_creator(
@@ -37,14 +43,16 @@ class Days(BaseModel):
 
 
 class PHeatingPeriod(BaseModel):
-    time_on: str
-    time_off: str
+    # the same limits as HeatingPeriod's validators, so bad input is a 422
+    # here rather than a ValidationError from the ORM mid-transaction
+    time_on: constr(regex=f"^{TIME_PATTERN}$")
+    time_off: constr(regex=f"^{TIME_PATTERN}$")
     days: Days
-    target: int
+    target: int = Field(..., ge=MIN_TARGET, le=MAX_TARGET)
     heating_system_id: int
     period_id: Optional[int] = None
 
-    @root_validator
+    @root_validator(skip_on_failure=True)
     def check_order(cls, v):
         time_on = datetime.strptime(v.get("time_on"), "%H:%M")
         time_off = datetime.strptime(v.get("time_off"), "%H:%M")
@@ -99,6 +107,13 @@ class SystemInfo(BaseModel):
     relay_on: bool
     program_on: bool
     target: float
+    reading_age: Optional[float] = None
+    system_id: Optional[int] = None
+
+
+class SystemErrorInfo(BaseModel):
+    system_id: int
+    message: str
 
 
 class ProgramOnlyResponse(BaseModel):
@@ -108,7 +123,66 @@ class ProgramOnlyResponse(BaseModel):
 
 class HeatingV2Response(BaseModel):
     systems: List[SystemInfo] = []
+    errors: List[SystemErrorInfo] = []
+
+
+class ReadingStats(BaseModel):
+    min: float
+    max: float
+    mean: float
+
+
+class HistoryBucket(BaseModel):
+    start: float
+    end: float
+    samples: int
+    relay_on: float
+    temperature: Optional[ReadingStats] = None
+    humidity: Optional[ReadingStats] = None
+    pressure: Optional[ReadingStats] = None
+    target: Optional[ReadingStats] = None
+
+
+class HistoryResponse(BaseModel):
+    system_id: int
+    buckets: List[HistoryBucket]
+
+
+class TelemetryPoint(BaseModel):
+    ts: float
+    samples: int
+    temperature_min: Optional[float] = None
+    temperature_max: Optional[float] = None
+    temperature_mean: Optional[float] = None
+    humidity_mean: Optional[float] = None
+    pressure_mean: Optional[float] = None
+    relay_on: float
+    target_mean: Optional[float] = None
+
+
+class RelayTransition(BaseModel):
+    ts: float
+    relay_on: bool
+
+
+class TelemetryResponse(BaseModel):
+    system_id: int
+    resolution: int
+    points: List[TelemetryPoint]
+    relay_transitions: List[RelayTransition]
 
 
 class TimesResponse(BaseModel):
     periods: List[PHeatingPeriod]
+
+
+class TimesBatch(BaseModel):
+    create: List[PHeatingPeriod] = []
+    update: List[PHeatingPeriod] = []
+    delete: List[int] = []
+
+
+class TimesBatchResponse(BaseModel):
+    created: List[PHeatingPeriod]
+    updated: List[PHeatingPeriod]
+    deleted: List[int]
@@ -46,3 +46,5 @@ class WeatherDay(WeatherDaySingle):
 class WeatherReport(BaseModel):
     current: WeatherDaySingle
     daily: List[WeatherDay]
+    age: Optional[float] = None
+    stale: bool = False
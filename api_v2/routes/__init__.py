@@ -3,3 +3,4 @@ from .heating import router as heating_router
 from .heating_v2 import router as heating_v2_router
 from .secrets import router as secrets_router
 from .weather import router as weather_router
+from .metrics import router as metrics_router
@@ -1,13 +1,13 @@
 import time
-from fastapi import Depends, status, APIRouter
-from starlette.exceptions import HTTPException
+from fastapi import Depends, HTTPException, status, APIRouter
 from fastapi.security import OAuth2PasswordBearer, OAuth2PasswordRequestForm
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from pydantic import BaseModel
 import json
+from ..cache import MISSING, token_cache, user_cache
+from ..utils import PasswordPoolBusy, password_pool
 from ..secrets.constants import (
     SECRET_KEY,
     ALGORITHM,
@@ -22,12 +22,13 @@ from ..models import (
     PasswordChange,
 )
 from ..logger import get_logger
+from ..metrics import TimedRoute, timed_phase
 from ..settings import GLOBAL_LOG_LEVEL
 
 logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+optional_oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
 credentials_exception = HTTPException(
     status_code=status.HTTP_401_UNAUTHORIZED,
@@ -44,22 +45,39 @@ class TokenData(BaseModel):
     username: Optional[str] = None
 
 
-def get_password_hash(password):
-    return pwd_context.hash(password)
+busy_exception = HTTPException(
+    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+    detail="Too many password checks in progress, please try again",
+    headers={"Retry-After": "1"},
+)
+
 
+async def get_password_hash(password):
+    try:
+        return await password_pool.hash(password)
+    except PasswordPoolBusy:
+        raise busy_exception
 
-def verify_password(password, hash):
-    return pwd_context.verify(password, hash)
+
+async def verify_password(password, hash):
+    try:
+        return await password_pool.verify(password, hash)
+    except PasswordPoolBusy:
+        raise busy_exception
 
 
 async def authenticate_user(
     username: str, password: str
 ) -> Optional[HouseholdMemberPydantic]:
-    user = await HouseholdMember.get(name=username)
+    user = await HouseholdMember.get_or_none(name=username)
+    if user is None:
+        return None
     try:
-        if not verify_password(password, user.password_hash):
+        if not await verify_password(password, user.password_hash):
             return False
         return user
+    except HTTPException:
+        raise
     except Exception:
         return None
 
@@ -82,19 +100,48 @@ def decode_jwt(token: str) -> dict:
         return {"message": "token expired, please log in again"}
 
 
+async def get_user_by_name(name: str) -> Optional[HouseholdMember]:
+    user = user_cache.get(name)
+    if user is MISSING:
+        user = await HouseholdMember.get_or_none(name=name)
+        user_cache.set(name, user)
+    return user
+
+
+def invalidate_user(name: str):
+    user_cache.invalidate(name)
+    token_cache.invalidate_subject(name)
+
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
-    try:
-        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    with timed_phase("auth"):
+        payload = token_cache.get(token)
+        if payload is None:
+            try:
+                payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+            except JWTError:
+                raise credentials_exception
+            token_cache.set(token, payload)
         username: str = payload.get("sub")
         if username is None:
             raise credentials_exception
         token_data = TokenData(username=username)
-    except JWTError:
-        raise credentials_exception
-    user = await HouseholdMember.get(name=token_data.username)
-    if user is None:
+        user = await get_user_by_name(token_data.username)
+        if user is None:
+            raise credentials_exception
+        return user
+
+
+async def get_stream_user(
+    token: Optional[str] = Depends(optional_oauth2_scheme),
+    access_token: Optional[str] = None,
+):
+    """get_current_user that also accepts ?access_token=, since browsers'
+    EventSource can't send an Authorization header"""
+    token = token or access_token
+    if not token:
         raise credentials_exception
-    return user
+    return await get_current_user(token)
 
 
 async def get_current_active_user(
@@ -110,7 +157,8 @@ async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
 ) -> Token:
     logger.debug(f"Attempted login from {form_data.username}")
-    user = await authenticate_user(form_data.username, form_data.password)
+    with timed_phase("auth"):
+        user = await authenticate_user(form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -136,6 +184,17 @@ async def check_superuser(
         return user
 
 
+async def get_superuser(
+    user: HouseholdMemberPydantic = Depends(get_current_user),
+) -> HouseholdMemberPydantic:
+    if user.id not in SUPERUSERS:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="You need to be a superuser to do this.",
+        )
+    return user
+
+
 @router.post("/users/")
 async def create_user(
     user: HouseholdMemberPydanticIn,
@@ -144,10 +203,11 @@ async def create_user(
     if superuser:
         user_obj = HouseholdMember(
             name=user.name,
-            password_hash=get_password_hash(user.password_hash),
+            password_hash=await get_password_hash(user.password_hash),
             household_id=1,
         )
         await user_obj.save()
+        invalidate_user(user_obj.name)
         return await HouseholdMemberPydantic.from_tortoise_orm(user_obj)
     else:
         raise HTTPException(
@@ -162,9 +222,11 @@ async def change_password(
     user: HouseholdMemberPydantic = Depends(get_current_active_user),
 ):
     user = await HouseholdMember.get(id=user.id)
-    if not user.verify_password(body.current_password):
+    if not await verify_password(body.current_password, user.password_hash):
         raise HTTPException(status_code=401)
     if not body.new_password == body.password_check:
         raise HTTPException(status_code=422)
-    user.password_hash = get_password_hash(body.new_password)
+    user.password_hash = await get_password_hash(body.new_password)
+    await user.save()
+    invalidate_user(user.name)
     return {"message": "Password changed"}
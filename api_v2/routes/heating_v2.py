@@ -1,7 +1,9 @@
-from typing import Optional
+import asyncio
+import time
+from typing import Optional, Union
 
-from fastapi import APIRouter, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import ValidationError
 
 from api_v2.heating.manage_systems import (
@@ -11,22 +13,88 @@ from api_v2.heating.manage_systems import (
     get_system,
     create_instance,
     kill_system,
+    wake_household_systems,
+)
+from api_v2.heating.broadcaster import state_broadcaster
+from api_v2.heating.control_scheduler import control_scheduler
+from api_v2.heating.gpio_state import gpio_hosts
+from api_v2.heating.telemetry_store import telemetry_store
+from api_v2.heating.manage_times import (
+    apply_times_batch,
+    get_times,
+    delete_time,
+    response_period,
+    update_time,
 )
-from api_v2.heating.manage_times import get_times, delete_time, update_time
 from api_v2.models import (
     HouseholdMember,
     Household,
     HeatingV2Response,
     SystemInfo,
+    SystemErrorInfo,
     PHeatingPeriod,
     PHeatingSystemIn,
+    HeatingSystemModel,
     HeatingSystemModelCreator,
     ProgramOnlyResponse,
     TimesResponse,
+    TimesBatch,
+    TimesBatchResponse,
+    HistoryResponse,
+    TelemetryResponse,
+)
+from api_v2.routes.authentication import (
+    get_current_active_user,
+    get_current_user,
+    get_stream_user,
 )
-from api_v2.routes.authentication import get_current_active_user, get_current_user
+from api_v2.logger import get_logger
+from api_v2.metrics import TimedRoute
+from api_v2.settings import (
+    GLOBAL_LOG_LEVEL,
+    HISTORY_MAX_MINUTES,
+    SENSOR_FETCH_DEADLINE,
+    STREAM_KEEPALIVE,
+    TELEMETRY_CAPACITY,
+)
+
+logger = get_logger(__name__, level=GLOBAL_LOG_LEVEL)
 
-router = APIRouter(prefix="/v2")
+router = APIRouter(prefix="/v2", route_class=TimedRoute)
+
+
+async def get_system_info(
+    system_id: int, household_id: int
+) -> Union[SystemInfo, SystemErrorInfo]:
+    try:
+        system = await get_system_instance_from_memory(system_id, household_id)
+        measurements = await asyncio.wait_for(
+            system.get_measurements(), SENSOR_FETCH_DEADLINE
+        )
+    except ValueError as e:
+        return SystemErrorInfo(system_id=system_id, message=str(e))
+    except asyncio.TimeoutError:
+        return SystemErrorInfo(
+            system_id=system_id, message=f"System {system_id} timed out"
+        )
+    except Exception as e:
+        # one unreachable sensor or Pi must not fail the whole household
+        logger.exception(f"Fetching system {system_id} failed: {e}")
+        return SystemErrorInfo(
+            system_id=system_id, message=f"System {system_id} not responding"
+        )
+    if not measurements:
+        return SystemErrorInfo(
+            system_id=system_id, message=f"System {system_id} not responding"
+        )
+    return SystemInfo(
+        sensor_readings=measurements,
+        relay_on=system.relay_state,
+        program_on=system.program_on,
+        target=system.current_period.target if system.current_period else 5,
+        reading_age=system.readings.age,
+        system_id=system_id,
+    )
 
 
 @router.get("/heating")
@@ -46,26 +114,102 @@ async def get_heating_info(
             relay_on=hs.relay_state,
             program_on=hs.program_on,
             target=hs.current_period.target if hs.current_period else 5,
+            reading_age=hs.readings.age,
+            system_id=system_id,
         )
         return system_info
     response = HeatingV2Response()
     household = await Household.get(id=user.household_id)
     await household.fetch_related("heating_systems")
-    for system_from_db in household.heating_systems:
-        if system_from_db.activated:
-            system = await get_system_instance_from_memory(
-                system_from_db.system_id, user.household_id
-            )
-            system_info = SystemInfo(
-                sensor_readings=await system.get_measurements() or {},
-                relay_on=system.relay_state,
-                program_on=system.program_on,
-                target=system.current_period.target if system.current_period else 5,
-            )
-            response.systems.append(system_info)
+    results = await asyncio.gather(
+        *(
+            get_system_info(system_from_db.system_id, user.household_id)
+            for system_from_db in household.heating_systems
+            if system_from_db.activated
+        )
+    )
+    for result in results:
+        if isinstance(result, SystemInfo):
+            response.systems.append(result)
+        else:
+            response.errors.append(result)
     return response
 
 
+@router.get("/heating/stream")
+async def heating_stream(user: HouseholdMember = Depends(get_stream_user)):
+    """Server-Sent Events for the household: one `snapshot` with every
+    system's state, then a `delta` with the changed fields whenever a
+    system's reading, relay, program or period changes, and `removed`
+    when a system stops"""
+    household_id = user.household_id
+
+    async def events():
+        # subscribing and taking the snapshot without awaiting in between
+        # means the deltas that follow apply exactly on top of it
+        queue = state_broadcaster.subscribe(household_id)
+        try:
+            yield b"retry: 3000\n\n" + state_broadcaster.snapshot(household_id)
+            while True:
+                try:
+                    message = await asyncio.wait_for(queue.get(), STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield b": keep-alive\n\n"
+                    continue
+                if message is None:
+                    return
+                yield message
+        finally:
+            state_broadcaster.unsubscribe(household_id, queue)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.get("/heating/history", response_model=HistoryResponse)
+async def get_heating_history(
+    system_id: int,
+    minutes: int = Query(60, ge=1, le=HISTORY_MAX_MINUTES),
+    buckets: int = Query(60, ge=1, le=TELEMETRY_CAPACITY),
+    user: HouseholdMember = Depends(get_current_user),
+):
+    hs = await get_system_from_memory_http(system_id, user.household_id)
+    until = time.time()
+    return HistoryResponse(
+        system_id=system_id,
+        buckets=hs.telemetry.downsample(until - minutes * 60, until, buckets),
+    )
+
+
+@router.get("/heating/telemetry", response_model=TelemetryResponse)
+async def get_stored_telemetry(
+    system_id: int,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    user: HouseholdMember = Depends(get_current_user),
+):
+    """Stored readings for any range; long ranges are served from rollups"""
+    await get_system_from_memory_http(system_id, user.household_id)
+    until = until if until is not None else time.time()
+    since = since if since is not None else until - 86400
+    if since >= until:
+        raise HTTPException(422, "since must be before until")
+    resolution, points, transitions = await telemetry_store.query(
+        system_id, since, until
+    )
+    return TelemetryResponse(
+        system_id=system_id,
+        resolution=resolution,
+        points=points,
+        relay_transitions=[
+            {"ts": ts, "relay_on": relay_on} for ts, relay_on in transitions
+        ],
+    )
+
+
 @router.get("/heating/program")
 async def heating_on_off(
     system_id: int, user: HouseholdMember = Depends(get_current_active_user)
@@ -83,15 +227,8 @@ async def heating_on_off(
 async def get_heating_periods(
     user: HouseholdMember = Depends(get_current_active_user),
 ):
-    return TimesResponse(
-        periods=[
-            PHeatingPeriod(
-                **period.dict(exclude_unset=True),
-                heating_system_id=period.heating_system.system_id,
-            )
-            for period in await get_times(user.household_id)
-        ]
-    )
+    periods = await get_times(user.household_id)
+    return TimesResponse.construct(periods=[response_period(p) for p in periods])
 
 
 @router.post("/heating/times")
@@ -101,9 +238,11 @@ async def new_period(
 ):
     hs = await get_system_from_memory_http(period.heating_system_id, user.household_id)
     try:
-        return await hs.new_time(period, user.id)
+        _time = await hs.new_time(period, user.id)
     except ValueError as e:
         raise HTTPException(422, str(e))
+    wake_household_systems(user.household_id)
+    return _time
 
 
 @router.delete("/heating/times")
@@ -111,7 +250,9 @@ async def delete_period(
     period_id: int,
     user: HouseholdMember = Depends(get_current_active_user),
 ):
-    return await delete_time(period_id=period_id)
+    response = await delete_time(period_id=period_id)
+    wake_household_systems(user.household_id)
+    return response
 
 
 @router.put("/heating/times")
@@ -123,11 +264,28 @@ async def update_period(
         p = await update_time(user.household_id, period)
     except ValueError as e:
         raise HTTPException(422, detail=str(e))
-    hs = await get_system_from_memory_http(period.heating_system_id, user.household_id)
-    await hs.main_task()
+    await get_system_from_memory_http(period.heating_system_id, user.household_id)
+    wake_household_systems(user.household_id)
     return PHeatingPeriod(**p.__dict__)
 
 
+@router.post("/heating/times/batch", response_model=TimesBatchResponse)
+async def batch_periods(
+    batch: TimesBatch,
+    user: HouseholdMember = Depends(get_current_active_user),
+):
+    """Creates, updates and deletes periods together: all are checked for
+    overlaps in one pass and written in one transaction, or none are"""
+    try:
+        created, updated, deleted = await apply_times_batch(
+            user.household_id, batch, user.id
+        )
+    except ValueError as e:
+        raise HTTPException(422, detail=str(e))
+    wake_household_systems(user.household_id)
+    return TimesBatchResponse(created=created, updated=updated, deleted=deleted)
+
+
 @router.post("/heating/system")
 async def new_heating_system(
     system: PHeatingSystemIn,
@@ -151,6 +309,23 @@ async def update_heating_system(
     return await HeatingSystemModelCreator.from_tortoise_orm(system)
 
 
+@router.get("/heating/system/ticks")
+async def system_tick_stats(user: HouseholdMember = Depends(get_current_active_user)):
+    systems = await HeatingSystemModel.get_by_household_id(user.household_id)
+    return {
+        system.system_id: control_scheduler.stats(system.system_id)
+        for system in systems
+        if system.is_running
+    }
+
+
+@router.get("/heating/gpio")
+async def gpio_connection_stats(
+    user: HouseholdMember = Depends(get_current_active_user),
+):
+    return {"hosts": gpio_hosts.stats()}
+
+
 @router.get("/heating/system/start")
 async def start_system(
     system_id: int, user: HouseholdMember = Depends(get_current_active_user)
@@ -0,0 +1,103 @@
+import time
+
+from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi.responses import PlainTextResponse
+
+from .authentication import get_superuser
+from ..metrics import (
+    ProfilerBusy,
+    TimedRoute,
+    default_registry,
+    memory_tracker,
+    object_counts,
+    profiler,
+)
+from ..models import HouseholdMember
+from ..settings import (
+    METRICS_PUBLIC,
+    PROFILER_ENABLED,
+    PROFILER_INTERVAL,
+    PROFILER_MAX_SECONDS,
+    TRACEMALLOC_FRAMES,
+)
+
+router = APIRouter(route_class=TimedRoute)
+
+
+class PrometheusResponse(PlainTextResponse):
+    media_type = "text/plain; version=0.0.4"
+
+
+@router.get(
+    "/metrics",
+    response_class=PrometheusResponse,
+    dependencies=[] if METRICS_PUBLIC else [Depends(get_superuser)],
+)
+async def metrics():
+    """Counters and histograms in the Prometheus text exposition format"""
+    return default_registry.render()
+
+
+@router.get("/debug/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10, gt=0, le=PROFILER_MAX_SECONDS),
+    interval: float = Query(PROFILER_INTERVAL, ge=0.001, le=1),
+    user: HouseholdMember = Depends(get_superuser),
+):
+    """Samples the event loop for `seconds` and returns collapsed stacks"""
+    if not PROFILER_ENABLED:
+        raise HTTPException(status_code=404, detail="Profiler is disabled")
+    try:
+        stacks = await profiler.profile(seconds, interval)
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    filename = f"profile-{time.strftime('%Y%m%d-%H%M%S')}.collapsed"
+    return PlainTextResponse(
+        stacks, headers={"Content-Disposition": f"attachment; filename={filename}"}
+    )
+
+
+@router.get("/debug/memory")
+async def memory_status(user: HouseholdMember = Depends(get_superuser)):
+    """Resident and traced memory, gc generation counts and logging handlers"""
+    return memory_tracker.status()
+
+
+@router.get("/debug/memory/objects")
+async def memory_objects(
+    limit: int = Query(30, gt=0, le=500),
+    user: HouseholdMember = Depends(get_superuser),
+):
+    """Live objects by type, including HeatingSystem and pigpio connections"""
+    return object_counts(limit)
+
+
+@router.post("/debug/memory/tracing")
+async def start_tracing(
+    frames: int = Query(TRACEMALLOC_FRAMES, gt=0, le=50),
+    user: HouseholdMember = Depends(get_superuser),
+):
+    memory_tracker.start_tracing(frames)
+    return memory_tracker.status()
+
+
+@router.delete("/debug/memory/tracing")
+async def stop_tracing(user: HouseholdMember = Depends(get_superuser)):
+    memory_tracker.stop_tracing()
+    return memory_tracker.status()
+
+
+@router.post("/debug/memory/snapshot")
+async def memory_snapshot(
+    limit: int = Query(25, gt=0, le=500),
+    save: bool = False,
+    user: HouseholdMember = Depends(get_superuser),
+):
+    """Top allocation sites and the change since the previous snapshot;
+    `save` also writes the snapshot to disk"""
+    if not memory_tracker.tracing:
+        raise HTTPException(status_code=409, detail="tracemalloc is not running")
+    result = memory_tracker.snapshot(limit)
+    if save:
+        result["path"] = str(memory_tracker.dump())
+    return result
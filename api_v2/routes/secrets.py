@@ -1,10 +1,11 @@
 from fastapi import APIRouter, Depends
 
 from .authentication import get_current_active_user
+from ..metrics import TimedRoute
 from ..models import HouseholdMember
 from ..secrets import initialized_config as config
 
-router = APIRouter(prefix="/secrets")
+router = APIRouter(prefix="/secrets", route_class=TimedRoute)
 
 
 @router.get("/telegram-bot-token/")
@@ -2,25 +2,23 @@ from typing import Optional
 
 from fastapi import APIRouter, HTTPException
 
-from ..cache import get_weather, set_weather
-from ..heating.constants import WEATHER_URL
+from ..cache import weather_service
+from ..metrics import TimedRoute
 from ..models import WeatherReport
-from ..utils import get_json
+from ..settings import WEATHER_STALE_AFTER
 
-router = APIRouter()
+router = APIRouter(route_class=TimedRoute)
 
 
 @router.get("/weather/", response_model=Optional[WeatherReport])
 async def weather():
-    """Gets weather info from OpenWeatherMap API or from local cache"""
-    weather_dict = await get_weather()
+    """Latest OpenWeatherMap report from memory; `age` is in seconds and
+    `stale` is set when refreshing has been failing"""
+    weather_dict, age = await weather_service.get()
     try:
         if not weather_dict:
-            r = await get_json(WEATHER_URL)
-            weather_dict = {"current": r["current"], "daily": r["daily"]}
-            await set_weather(weather_dict)
-        weather_report = WeatherReport(**weather_dict)
-        return weather_report
+            raise KeyError("weather")
+        return WeatherReport(**weather_dict, age=age, stale=age > WEATHER_STALE_AFTER)
     except KeyError:
         raise HTTPException(
             status_code=500, detail="OpenWeatherMap API not setup or not responding"
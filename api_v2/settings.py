@@ -1,7 +1,24 @@
 import logging
 import os
+from urllib.parse import urlencode
 
-DATABASE_URL = f"sqlite://{os.path.abspath(os.getcwd())}/db.sqlite3"
+# PRAGMAs Tortoise (and aerich) run on each SQLite connection they open.
+# journal_mode=WAL is Tortoise's own default, repeated so the dependency on it
+# is explicit: under WAL, synchronous=NORMAL only syncs at checkpoints
+# instead of on every commit.
+SQLITE_PRAGMAS = {
+    "journal_mode": "WAL",
+    "synchronous": "NORMAL",
+    "cache_size": -16000,  # negative is KiB
+    "mmap_size": 64 * 1024 * 1024,
+    "temp_store": "MEMORY",
+    "busy_timeout": 5000,
+}
+DATABASE_PATH = f"{os.path.abspath(os.getcwd())}/db.sqlite3"
+DATABASE_URL = f"sqlite://{DATABASE_PATH}?{urlencode(SQLITE_PRAGMAS)}"
+# Log the query plans of the hot queries at startup (api_v2.models.database)
+DATABASE_QUERY_PLAN_REPORT = True
+TELEMETRY_DB_PATH = f"{os.path.abspath(os.getcwd())}/telemetry.sqlite3"
 
 TORTOISE_MODELS_LIST = ["api_v2.models", "aerich.models"]
 
@@ -15,3 +32,104 @@ TORTOISE_ORM = {
 }
 
 GLOBAL_LOG_LEVEL = logging.INFO
+
+# Shared aiohttp client (api_v2.utils.async_requests)
+HTTP_POOL_LIMIT = 100
+HTTP_POOL_LIMIT_PER_HOST = 2
+HTTP_DNS_CACHE_TTL = 300
+HTTP_KEEPALIVE_TIMEOUT = 30
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 10
+HTTP_TOTAL_TIMEOUT = 20
+
+# Sensor readings younger than this (seconds) are served from memory
+SENSOR_READING_TTL = 10
+
+# Per-system deadline (seconds) when fetching readings for a whole household
+SENSOR_FETCH_DEADLINE = 5
+
+# Control loop wakes at schedule edges and on API changes instead of only
+# polling every interval; the margin (seconds) is added after each edge
+EVENT_DRIVEN_CONTROL = True
+SCHEDULE_EDGE_MARGIN = 1
+
+# Central control scheduler (api_v2.heating.control_scheduler)
+CONTROL_MAX_CONCURRENT_TICKS = 4
+SLOW_TICK_WARNING = 5
+# Turning a program on or off waits this long for the tick that applies it
+PROGRAM_CHANGE_TIMEOUT = 10
+
+# GPIO backend for relays: "executor" (pigpio library on a worker thread),
+# "asyncio" (native pigpiod socket client) or "fake"
+GPIO_BACKEND = "executor"
+PIGPIOD_PORT = 8888
+GPIO_COMMAND_TIMEOUT = 5
+
+# Relay levels are re-read from the Pi (one bank read per host) this often
+GPIO_REFRESH_INTERVAL = 30
+GPIO_HEALTH_CHECK_INTERVAL = 60
+GPIO_IDLE_TIMEOUT = 300
+GPIO_RECONNECT_MIN_DELAY = 1
+GPIO_RECONNECT_MAX_DELAY = 60
+
+# Program on/off changes are written to heating/config.json after this delay
+PROGRAM_STATE_WRITE_DELAY = 1
+
+# Weather is refreshed in the background this often (seconds) and retried
+# after failures; Redis keeps the last report long enough to start warm and
+# to be served (with its age) while OpenWeatherMap is unreachable
+WEATHER_REFRESH_INTERVAL = 600
+WEATHER_RETRY_DELAY = 60
+WEATHER_STALE_AFTER = 900
+WEATHER_CACHE_EXPIRY = 6 * 3600
+
+# /v2/heating/stream: events buffered per client before it is dropped, and
+# the keep-alive comment interval (seconds)
+STREAM_QUEUE_SIZE = 100
+STREAM_KEEPALIVE = 15
+
+# Verified tokens and users kept in memory by get_current_user
+AUTH_TOKEN_CACHE_SIZE = 256
+AUTH_USER_CACHE_SIZE = 256
+AUTH_USER_CACHE_TTL = 60
+
+# bcrypt runs on its own threads; logins beyond the pending limit get a 503
+PASSWORD_WORKERS = 2
+PASSWORD_MAX_PENDING = 4
+
+# Diagnostics (api_v2.metrics), both off by default: Server-Timing response
+# headers, and the superuser-only sampling profiler at /debug/profile
+SERVER_TIMING = False
+PROFILER_ENABLED = False
+PROFILER_INTERVAL = 0.01
+PROFILER_MAX_SECONDS = 60
+# /metrics carries system ids, so it needs a superuser token unless a scraper
+# without one has to reach it
+METRICS_PUBLIC = False
+
+# Memory introspection (api_v2.metrics.memory). With a threshold set,
+# tracemalloc runs from startup and a snapshot is written to MEMORY_DUMP_DIR
+# whenever resident memory crosses it
+MEMORY_DUMP_THRESHOLD_MB = None
+MEMORY_CHECK_INTERVAL = 300
+MEMORY_DUMP_DIR = f"{os.path.abspath(os.getcwd())}/memory-dumps"
+TRACEMALLOC_FRAMES = 1
+
+# Samples kept in memory per system for /v2/heating/history, which allows
+# at most one bucket per sample and the span the buffer covers at one sample
+# per (60 second) control tick
+TELEMETRY_CAPACITY = 1440
+HISTORY_MAX_MINUTES = TELEMETRY_CAPACITY
+
+# Write-behind telemetry store (api_v2.heating.telemetry_store)
+TELEMETRY_FLUSH_INTERVAL = 30
+TELEMETRY_BATCH_SIZE = 500
+TELEMETRY_MAX_PENDING = 10000
+TELEMETRY_ROLLUP_INTERVAL = 300
+# seconds to keep raw rows (0) and each rollup resolution; None keeps forever
+TELEMETRY_RETENTION = {
+    0: 7 * 86400,
+    300: 90 * 86400,
+    3600: 2 * 365 * 86400,
+    86400: None,
+}
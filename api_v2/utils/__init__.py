@@ -1,3 +1,4 @@
 from .telegram_bot import send_message as send_telegram_message
-from .async_requests import get_json
+from .async_requests import get_json, init_http_session, close_http_session
 from .custom_datetimes import BritishTime
+from .passwords import PasswordPoolBusy, password_pool
@@ -0,0 +1,58 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+from passlib.context import CryptContext
+
+from api_v2.metrics import Counter, Gauge
+from api_v2.settings import PASSWORD_WORKERS, PASSWORD_MAX_PENDING
+
+pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+
+PASSWORD_REJECTIONS = Counter(
+    "password_pool_rejections", "Password operations refused because the pool was full"
+)
+
+
+class PasswordPoolBusy(Exception):
+    pass
+
+
+class PasswordPool:
+    """Runs bcrypt on a few dedicated threads (bcrypt releases the GIL), so
+    hashing never blocks the event loop. At most `max_pending` operations
+    may be running or queued; beyond that callers get PasswordPoolBusy
+    straight away instead of waiting behind a burst of logins."""
+
+    def __init__(
+        self, workers: int = PASSWORD_WORKERS, max_pending: int = PASSWORD_MAX_PENDING
+    ):
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="bcrypt"
+        )
+
+    async def _run(self, func, *args):
+        if self.pending >= self.max_pending:
+            PASSWORD_REJECTIONS.inc()
+            raise PasswordPoolBusy("Too many password operations in progress")
+        self.pending += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, func, *args
+            )
+        finally:
+            self.pending -= 1
+
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, password: str, hash: str) -> bool:
+        return await self._run(pwd_context.verify, password, hash)
+
+
+password_pool = PasswordPool()
+
+Gauge(
+    "password_pool_pending", "Password operations running or queued"
+).set_function(lambda: password_pool.pending)
@@ -0,0 +1,419 @@
+"""Benchmarks the api_v2 routes in-process.
+
+Calls the ASGI app directly (no sockets) against a temporary SQLite
+database, an in-memory stand-in for Redis and a fake sensor fleet, and
+reports throughput and p50/p95/p99 latency per route and concurrency.
+Results can be saved as a baseline and later runs compared against it:
+
+    python scripts/api_benchmark.py --save-baseline api_baseline.json
+    python scripts/api_benchmark.py --baseline api_baseline.json --threshold 0.2
+
+The second command exits with status 1 if any route got slower (p95) or
+lost throughput by more than the threshold.
+"""
+import argparse
+import asyncio
+import json
+import sys
+import tempfile
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+from urllib.parse import urlencode
+
+ROOT_DIR = Path(__file__).parent.parent.absolute()
+sys.path.insert(0, str(ROOT_DIR))
+
+from tortoise import Tortoise
+
+import api_v2
+from api_v2 import settings
+from api_v2.cache import cache as redis_cache
+from api_v2.heating.fake_sensors import FakeSensorFleet
+from api_v2.heating.heating_system import HeatingSystem
+from api_v2.heating.program_state import program_state
+from api_v2.heating.systems_in_memory import systems_in_memory
+from api_v2.metrics import instrument_tortoise
+from api_v2.models import Household, HouseholdMember, HeatingSystemModel
+from api_v2.routes.authentication import get_password_hash
+from api_v2.utils import init_http_session, close_http_session
+from load_harness import percentiles
+
+USERNAME = "benchmark"
+PASSWORD = "benchmark-password"
+
+WEATHER_DETAILS = [{"id": 800, "main": "Clear", "description": "clear", "icon": "01d"}]
+WEATHER_DAY = {
+    "dt": 0,
+    "sunrise": 0,
+    "sunset": 0,
+    "pressure": 1013,
+    "humidity": 50,
+    "dew_point": 5.0,
+    "uvi": 1.0,
+    "clouds": 0,
+    "wind_speed": 2.0,
+    "wind_deg": 180,
+    "wind_gust": 3.0,
+    "weather": WEATHER_DETAILS,
+}
+BREAKDOWN = {"day": 10.0, "min": 5.0, "max": 12.0, "night": 6.0, "eve": 9.0, "morn": 7.0}
+WEATHER = {
+    "current": {**WEATHER_DAY, "temp": 10.0, "feels_like": 9.0},
+    "daily": [
+        {**WEATHER_DAY, "temp": BREAKDOWN, "feels_like": BREAKDOWN, "pop": 0}
+        for _ in range(7)
+    ],
+}
+
+
+class InMemoryRedis:
+    """Just enough of the aioredis pool interface for api_v2.cache"""
+
+    def __init__(self):
+        self.data = {}
+
+    async def set(self, key, value):
+        self.data[key] = value
+
+    async def get(self, key, encoding=None):
+        return self.data.get(key)
+
+    async def keys(self, pattern, encoding=None):
+        return list(self.data)
+
+    async def delete(self, key):
+        self.data.pop(key, None)
+
+    async def execute(self, command, key, value=None, *args):
+        if command.lower() == "set":
+            self.data[key] = value
+
+
+class ASGIClient:
+    def __init__(self, app):
+        self.app = app
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        query: Optional[dict] = None,
+        json_body=None,
+        form: Optional[dict] = None,
+        token: Optional[str] = None,
+    ) -> Tuple[int, bytes]:
+        body = b""
+        headers = [(b"host", b"benchmark")]
+        if json_body is not None:
+            body = json.dumps(json_body).encode()
+            headers.append((b"content-type", b"application/json"))
+        elif form is not None:
+            body = urlencode(form).encode()
+            headers.append((b"content-type", b"application/x-www-form-urlencoded"))
+        if token is not None:
+            headers.append((b"authorization", f"Bearer {token}".encode()))
+        headers.append((b"content-length", str(len(body)).encode()))
+        scope = {
+            "type": "http",
+            "asgi": {"version": "3.0"},
+            "http_version": "1.1",
+            "method": method,
+            "scheme": "http",
+            "path": path,
+            "raw_path": path.encode(),
+            "root_path": "",
+            "query_string": urlencode(query or {}).encode(),
+            "headers": headers,
+            "client": ("127.0.0.1", 0),
+            "server": ("benchmark", 80),
+        }
+        messages = [{"type": "http.request", "body": body, "more_body": False}]
+        response = {"status": None, "body": []}
+
+        async def receive():
+            return messages.pop(0) if messages else {"type": "http.disconnect"}
+
+        async def send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+
+        await self.app(scope, receive, send)
+        return response["status"], b"".join(response["body"])
+
+
+class Benchmark:
+    def __init__(self, client: ASGIClient, token: str, system_ids: List[int]):
+        self.client = client
+        self.token = token
+        self.system_ids = system_ids
+
+    async def timed(self, label: str, samples: list, *args, **kwargs) -> bytes:
+        started = time.perf_counter()
+        status, body = await self.client.request(*args, **kwargs)
+        samples.append((label, status, time.perf_counter() - started))
+        return body
+
+    async def login(self, worker: int, samples: list):
+        await self.timed(
+            "POST /token/",
+            samples,
+            "POST",
+            "/token/",
+            form={"username": USERNAME, "password": PASSWORD},
+        )
+
+    async def check_token(self, worker: int, samples: list):
+        await self.timed(
+            "GET /check_token/", samples, "GET", "/check_token/", token=self.token
+        )
+
+    async def heating_system(self, worker: int, samples: list):
+        system_id = self.system_ids[worker % len(self.system_ids)]
+        await self.timed(
+            "GET /v2/heating?system_id",
+            samples,
+            "GET",
+            "/v2/heating",
+            query={"system_id": system_id},
+            token=self.token,
+        )
+
+    async def heating_household(self, worker: int, samples: list):
+        await self.timed(
+            "GET /v2/heating", samples, "GET", "/v2/heating", token=self.token
+        )
+
+    async def times_get(self, worker: int, samples: list):
+        await self.timed(
+            "GET /v2/heating/times",
+            samples,
+            "GET",
+            "/v2/heating/times",
+            token=self.token,
+        )
+
+    async def times_cycle(self, worker: int, samples: list):
+        """POST, PUT and DELETE one period on this worker's own system"""
+        period = {
+            "time_on": "01:00",
+            "time_off": "02:00",
+            "days": {"monday": True},
+            "target": 18,
+            "heating_system_id": self.system_ids[worker],
+        }
+        body = await self.timed(
+            "POST /v2/heating/times",
+            samples,
+            "POST",
+            "/v2/heating/times",
+            json_body=period,
+            token=self.token,
+        )
+        period_id = json.loads(body).get("period_id")
+        if period_id is None:
+            return
+        await self.timed(
+            "PUT /v2/heating/times",
+            samples,
+            "PUT",
+            "/v2/heating/times",
+            json_body={**period, "period_id": period_id, "target": 19},
+            token=self.token,
+        )
+        await self.timed(
+            "DELETE /v2/heating/times",
+            samples,
+            "DELETE",
+            "/v2/heating/times",
+            query={"period_id": period_id},
+            token=self.token,
+        )
+
+    async def program(self, worker: int, samples: list):
+        await self.timed(
+            "GET /v2/heating/program",
+            samples,
+            "GET",
+            "/v2/heating/program",
+            query={"system_id": self.system_ids[worker]},
+            token=self.token,
+        )
+
+    async def weather(self, worker: int, samples: list):
+        await self.timed("GET /weather/", samples, "GET", "/weather/")
+
+    def scenarios(self) -> Dict[str, Callable]:
+        return {
+            "token": self.login,
+            "check_token": self.check_token,
+            "heating_system": self.heating_system,
+            "heating_household": self.heating_household,
+            "times_get": self.times_get,
+            "times_cycle": self.times_cycle,
+            "program": self.program,
+            "weather": self.weather,
+        }
+
+
+async def run_scenario(scenario: Callable, concurrency: int, requests: int) -> dict:
+    samples = []
+    remaining = [requests]
+
+    async def worker(index: int):
+        while remaining[0] > 0:
+            remaining[0] -= 1
+            await scenario(index, samples)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(i) for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    results = {}
+    for label in sorted({label for label, _, _ in samples}):
+        durations = [d for l, _, d in samples if l == label]
+        errors = sum(1 for l, status, _ in samples if l == label and status >= 400)
+        results[label] = {
+            "requests": len(durations),
+            "errors": errors,
+            "throughput": len(durations) / elapsed,
+            **percentiles(durations),
+        }
+    return results
+
+
+async def setup(tmp: Path, systems: int, fleet: FakeSensorFleet) -> Benchmark:
+    pragmas = urlencode(settings.SQLITE_PRAGMAS)
+    await Tortoise.init(
+        config={
+            **settings.TORTOISE_ORM,
+            "connections": {"default": f"sqlite://{tmp}/db.sqlite3?{pragmas}"},
+        }
+    )
+    await Tortoise.generate_schemas()
+    instrument_tortoise()
+    redis_cache.cache_singleton = InMemoryRedis()
+    redis_cache.cache_singleton.data["weather"] = json.dumps(
+        {**WEATHER, "fetched_at": time.time()}
+    )
+    program_state.path = tmp / "config.json"
+    household = await Household.create()
+    await HouseholdMember.create(
+        name=USERNAME,
+        password_hash=await get_password_hash(PASSWORD),
+        household=household,
+    )
+    await init_http_session()
+    system_ids = []
+    for i in range(systems):
+        model = await HeatingSystemModel.create(
+            household=household,
+            sensor_url=fleet.url(i),
+            raspberry_pi="benchmark-pi",
+            gpio_pin=2 + i,
+            activated=True,
+        )
+        systems_in_memory[model.system_id] = HeatingSystem(
+            gpio_pin=model.gpio_pin,
+            temperature_url=model.sensor_url,
+            raspberry_pi_ip=model.raspberry_pi,
+            household_id=household.id,
+            system_id=model.system_id,
+            test=True,
+        )
+        system_ids.append(model.system_id)
+    client = ASGIClient(api_v2.app)
+    status, body = await client.request(
+        "POST", "/token/", form={"username": USERNAME, "password": PASSWORD}
+    )
+    return Benchmark(client, json.loads(body)["access_token"], system_ids)
+
+
+async def teardown():
+    for system_id in list(systems_in_memory):
+        systems_in_memory.pop(system_id).stop()
+    await close_http_session()
+    await Tortoise.close_connections()
+
+
+async def main(args) -> dict:
+    fleet = FakeSensorFleet(max(args.concurrency), latency=args.sensor_latency)
+    await fleet.start()
+    with tempfile.TemporaryDirectory() as tmp:
+        results = {}
+        try:
+            benchmark = await setup(Path(tmp), max(args.concurrency), fleet)
+            scenarios = benchmark.scenarios()
+            for name in args.scenarios or scenarios:
+                for concurrency in args.concurrency:
+                    requests = args.requests
+                    if name == "token":
+                        requests = min(requests, args.token_requests)
+                    for label, result in (
+                        await run_scenario(scenarios[name], concurrency, requests)
+                    ).items():
+                        key = f"{label} @{concurrency}"
+                        results[key] = result
+                        print(
+                            f"{key:<40} {result['throughput']:8.1f} req/s  "
+                            f"p50 {result['p50'] * 1000:7.1f} ms  "
+                            f"p95 {result['p95'] * 1000:7.1f} ms  "
+                            f"p99 {result['p99'] * 1000:7.1f} ms  "
+                            f"errors {result['errors']}",
+                            file=sys.stderr,
+                        )
+        finally:
+            await teardown()
+            await fleet.stop()
+    return results
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> List[str]:
+    regressions = []
+    for key, before in baseline.items():
+        after = results.get(key)
+        if after is None:
+            continue
+        if after["p95"] > before["p95"] * (1 + threshold):
+            regressions.append(
+                f"{key}: p95 {before['p95'] * 1000:.1f} -> {after['p95'] * 1000:.1f} ms"
+            )
+        if after["throughput"] < before["throughput"] * (1 - threshold):
+            regressions.append(
+                f"{key}: throughput {before['throughput']:.1f} -> "
+                f"{after['throughput']:.1f} req/s"
+            )
+    return regressions
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenarios", nargs="+")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument(
+        "--token-requests",
+        type=int,
+        default=20,
+        help="requests per level for /token/, which is dominated by bcrypt",
+    )
+    parser.add_argument("--sensor-latency", type=float, default=0.02)
+    parser.add_argument("--output", type=Path)
+    parser.add_argument("--save-baseline", type=Path)
+    parser.add_argument("--baseline", type=Path)
+    parser.add_argument("--threshold", type=float, default=0.2)
+    args = parser.parse_args()
+
+    results = asyncio.run(main(args))
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2))
+    if args.save_baseline:
+        args.save_baseline.write_text(json.dumps(results, indent=2))
+    if args.baseline:
+        regressions = compare(
+            results, json.loads(args.baseline.read_text()), args.threshold
+        )
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,195 @@
+"""Measures how many zones one instance can drive.
+
+Starts a fake sensor fleet and N HeatingSystem instances on fake GPIO, lets
+them tick for a while and reports tick latency percentiles, event loop lag,
+open sockets, CPU and memory for each N as JSON. All fake sensors share one
+host and port, so HTTP_POOL_LIMIT_PER_HOST also caps concurrent sensor
+requests here, unlike a real fleet. Example:
+
+    python scripts/load_harness.py --systems 1 10 100 1000 --output bench.json
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent.parent.absolute()
+sys.path.insert(0, str(ROOT_DIR))
+
+from api_v2.heating.fake_sensors import FakeSensorFleet
+from api_v2.heating.gpio_state import gpio_hosts
+from api_v2.heating.heating_system import HeatingSystem
+from api_v2.utils import init_http_session, close_http_session
+
+SYSTEM_ID_BASE = 10_000_000
+PINS_PER_HOST = 26
+
+
+class TimedHeatingSystem(HeatingSystem):
+    def __init__(self, *args, **kwargs):
+        self.tick_durations = []
+        super().__init__(*args, **kwargs)
+
+    async def main_task(self):
+        started = time.perf_counter()
+        try:
+            await super().main_task()
+        finally:
+            self.tick_durations.append(time.perf_counter() - started)
+
+
+def percentiles(values, points=(50, 95, 99)) -> dict:
+    if not values:
+        return {**{f"p{p}": None for p in points}, "max": None}
+    ordered = sorted(values)
+    result = {
+        f"p{p}": ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+        for p in points
+    }
+    result["max"] = ordered[-1]
+    return result
+
+
+def open_sockets() -> int:
+    try:
+        fds = os.listdir("/proc/self/fd")
+    except OSError:
+        return -1
+    count = 0
+    for fd in fds:
+        try:
+            count += os.readlink(f"/proc/self/fd/{fd}").startswith("socket:")
+        except OSError:
+            pass
+    return count
+
+
+def rss_mb() -> float:
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+async def monitor_loop_lag(samples: list, period: float = 0.1):
+    while True:
+        started = time.perf_counter()
+        await asyncio.sleep(period)
+        samples.append(time.perf_counter() - started - period)
+
+
+async def run(n: int, args) -> dict:
+    fleet = FakeSensorFleet(
+        n,
+        latency=args.latency,
+        jitter=args.jitter,
+        failure_rate=args.failure_rate,
+        base_temperature=args.base_temperature,
+        drift=args.drift,
+    )
+    await fleet.start()
+    await init_http_session()
+    lag = []
+    monitor = asyncio.get_running_loop().create_task(monitor_loop_lag(lag))
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    systems = [
+        TimedHeatingSystem(
+            gpio_pin=2 + i % PINS_PER_HOST,
+            temperature_url=fleet.url(i),
+            raspberry_pi_ip=f"fake-pi-{i // PINS_PER_HOST}",
+            household_id=1,
+            system_id=SYSTEM_ID_BASE + i,
+            interval=args.interval,
+            test=True,
+        )
+        for i in range(n)
+    ]
+    if args.reading_ttl is not None:
+        for system in systems:
+            system.readings.ttl = args.reading_ttl
+    await asyncio.sleep(args.duration)
+    sockets = open_sockets()
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+    memory = rss_mb()
+    relay_writes = sum(host.backend.calls["write"] for host in gpio_hosts.hosts())
+    monitor.cancel()
+    for system in systems:
+        system.stop()
+    await gpio_hosts.close_idle(0)
+    await close_http_session()
+    await fleet.stop()
+    ticks = [d for system in systems for d in system.tick_durations]
+    return {
+        "systems": n,
+        "duration": wall,
+        "ticks": len(ticks),
+        "tick_seconds": percentiles(ticks),
+        "loop_lag_seconds": percentiles(lag),
+        "open_sockets": sockets,
+        "cpu_seconds": cpu,
+        "cpu_percent": 100 * cpu / wall,
+        "rss_mb": memory,
+        "sensor_requests": fleet.requests,
+        "sensor_failures": fleet.failures,
+        "relay_writes": relay_writes,
+    }
+
+
+def git_revision() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_DIR,
+            capture_output=True,
+            text=True,
+        ).stdout.strip()
+    except OSError:
+        return ""
+
+
+async def main(args):
+    results = []
+    for n in args.systems:
+        result = await run(n, args)
+        print(json.dumps(result), file=sys.stderr)
+        results.append(result)
+    return {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "parameters": {
+            key: value for key, value in vars(args).items() if key != "output"
+        },
+        "results": results,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--systems", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--duration", type=float, default=30)
+    parser.add_argument("--interval", type=float, default=5)
+    parser.add_argument("--reading-ttl", type=float)
+    parser.add_argument("--latency", type=float, default=0.05)
+    parser.add_argument("--jitter", type=float, default=0.02)
+    parser.add_argument("--failure-rate", type=float, default=0.01)
+    parser.add_argument("--base-temperature", type=float, default=5.0)
+    parser.add_argument("--drift", type=float, default=0.05)
+    parser.add_argument("--output", type=Path)
+    args = parser.parse_args()
+    report = json.dumps(asyncio.run(main(args)), indent=2)
+    if args.output:
+        args.output.write_text(report)
+    else:
+        print(report)